@@ -0,0 +1,59 @@
+"""
+Per-call cost of fmt.dict_to_id, which builds the filename of every 'savedata'/'savefig' call.
+
+before:  isinstance chain on every value, no reuse of encodings (baseline implementation, reproduced below).
+after:   type-dispatched encoders (fmt.register_encoder) and memoized encodings of repeated scalars.
+
+Run: python benchmarks/encoder.py
+"""
+import os
+import sys
+import math
+import timeit
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # run from a source checkout
+from tidypath.fmt import dict_to_id, STR_TRANS_TABLE
+
+def encoder_before(x, ndigits=2, iterables=(list, tuple, np.ndarray), iterable_maxsize=3):
+    if isinstance(x, float):
+        if math.isinf(x) or math.isnan(x):
+            return str(x)
+        elif x == int(x):
+            return str(int(x))
+        else:
+            return str(round(x, ndigits=ndigits)).replace('.', '--')
+    elif isinstance(x, int):
+        return str(x)
+    elif callable(x) and hasattr(x, "__name__"):
+        return x.__name__
+    elif isinstance(x, dict):
+        if len(x) >= iterable_maxsize:
+            return "{}-values".format(str(len(x)))
+        else:
+            return dict_to_id_before(x, ndigits=ndigits, join_char="-", iterable_maxsize=iterable_maxsize)
+    elif isinstance(x, iterables):
+        if len(x) >= iterable_maxsize:
+            return "{}-values".format(str(len(x)))
+        else:
+            return '-'.join([encoder_before(sub_x) for sub_x in x])
+    else:
+        return str(x).translate(STR_TRANS_TABLE)
+
+def dict_to_id_before(*args, ndigits=2, join_char="_", iterable_maxsize=3, **kwargs):
+    key_formatter = lambda k: k.replace("_", "-")
+    d = args[0] if len(args) > 0 else kwargs
+    return join_char.join([f"{key_formatter(k)}-{encoder_before(d[k], ndigits=ndigits, iterable_maxsize=iterable_maxsize)}" for k in sorted(d.keys())])
+
+keys = [dict(n_samples=1000, learning_rate=0.01, model="resnet", seed=3),
+        dict(alpha=0.5, beta=2.75, gamma=None, method="newton", tol=1e-6, max_iter=500, verbose=False),
+        dict(region="north/east", years=(2019, 2020), weights=[0.25, 0.75], normalize=True, agg=np.mean),
+        dict(x=1.5, y=-3, z=math.inf, label="a:b", options=dict(mode="fast", depth=4)),
+       ]
+
+if __name__ == "__main__":
+    for d in keys:
+        assert dict_to_id_before(d, iterable_maxsize=math.inf) == dict_to_id(d, iterable_maxsize=math.inf)
+    n = 20000
+    for name, f in [("before", dict_to_id_before), ("after", dict_to_id)]:
+        t = min(timeit.repeat(lambda: [f(d, iterable_maxsize=math.inf) for d in keys], number=n, repeat=5)) / (n * len(keys))
+        print(f"{name:>8}: {t*1e6:.2f} us/call")
@@ -0,0 +1,38 @@
+"""
+Per-call overhead of the key classification done by the 'savedata'/'savefig' wrappers.
+
+before:  signature inspection, defaults and 'keys' parsing on every call (classify_call_attrs without a plan).
+after:   plan compiled at decoration time, 'keys' parsed once.
+
+Run: python benchmarks/wrapper_overhead.py
+"""
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # run from a source checkout
+from tidypath import config
+from tidypath.inspection import classify_call_attrs, compile_call_plan
+from tidypath._helper import merge_nested_dict, parse_keys, _parse_keys_str
+
+def slow_computation(x, y, *args, z=1, **kwargs):
+    return x
+
+def before(args, kwargs, keys):
+    _parse_keys_str.cache_clear()
+    key_opts = classify_call_attrs(slow_computation, args, kwargs, add_pos_only_to_all=config.KEYS_ADD_POSONLY_TO_ALL)
+    return merge_nested_dict(key_opts, keys, key_default="all")
+
+plan = compile_call_plan(slow_computation)
+parsed_keys = parse_keys("x+z+kwargs")
+
+def after(args, kwargs, keys):
+    key_opts = classify_call_attrs(slow_computation, args, kwargs, add_pos_only_to_all=config.KEYS_ADD_POSONLY_TO_ALL, plan=plan)
+    return merge_nested_dict(key_opts, keys, key_default="all", parsed_keys=parsed_keys)
+
+if __name__ == "__main__":
+    args, kwargs, keys = (1, 0), dict(z=10, extra="b"), "x+z+kwargs"
+    assert before(args, kwargs, keys) == after(args, kwargs, keys)
+    n = 100000
+    for name, f in [("before", before), ("after", after)]:
+        t = min(timeit.repeat(lambda: f(args, kwargs, keys), number=n, repeat=5)) / n
+        print(f"{name:>8}: {t*1e6:.2f} us/call")
@@ -29,5 +29,8 @@ setup(
     extras_require={
         "matplotlib": "matplotlib",
         "plotly": ["plotly", "kaleido"],
+        "parquet": "pyarrow",
+        "zstd": "zstandard",
+        "lz4": "lz4",
     },
 )
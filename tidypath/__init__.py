@@ -1,14 +1,25 @@
 from . import fmt
 from . import storage
+from . import memory
+from . import integrity
+from . import eviction
 from .decorators import savedata, savefig, SavedataSkippedComputation
-from .paths import add_arg, delete_arg, modify_arg
+from .paths import add_arg, delete_arg, modify_arg, resume_renames, rollback_renames, migrate_layout
+from .background import flush
 
 __all__ = ["savedata",
            "savefig",
            "SavedataSkippedComputation",
            'fmt',
            'storage',
+           'memory',
+           'integrity',
+           'eviction',
            "add_arg",
            'delete_arg',
-           'modify_arg'
+           'modify_arg',
+           'resume_renames',
+           'rollback_renames',
+           'migrate_layout',
+           'flush'
           ]
@@ -2,8 +2,30 @@
 Helper functions
 """
 import re
+from functools import lru_cache
 
-def merge_nested_dict(d, keys, key_default=None):
+_KEY_ADD = re.compile(r'(?:^|(?<=\+))(\w+)')
+_KEY_REMOVE = re.compile(r'(?<=-)(\w+)')
+
+@lru_cache(maxsize=256)
+def _parse_keys_str(keys):
+    key_add = frozenset(_KEY_ADD.findall(keys))
+    key_remove = frozenset(_KEY_REMOVE.findall(keys))
+    if not key_add and key_remove:
+        key_add = frozenset(["all"])
+    return key_add, key_remove
+
+def parse_keys(keys):
+    """
+    Returns the sets (key_add, key_remove) encoded in keys.
+    keys can be a string of the form 'k', 'k1+k2+...', 'k1-k2', or other iterables containing the keys.
+    """
+    if isinstance(keys, str):
+        return _parse_keys_str(keys)
+    else:
+        return frozenset(keys), frozenset()
+
+def merge_nested_dict(d, keys, key_default=None, parsed_keys=None):
     """
     Returns the result of merging several keys of a dictionary.
     
@@ -11,22 +33,17 @@ def merge_nested_dict(d, keys, key_default=None):
             - d:             nested dictionary
             - keys:          d keys to be merged. can be a string of the form 'k' or 'k1+k2+...', or other iterables containing the keys.
             - key_default:   if a key does not belong to d => it is searched in d[key_default]
+            - parsed_keys:   parse_keys(keys). Pass it to avoid parsing keys on every call.
     """
-    if isinstance(keys, str):
-        key_add = set(re.findall(r'(?:^|(?<=\+))(\w+)', keys))
-        key_remove = set(re.findall(r'(?<=-)(\w+)', keys))
-    else:
-        key_add = set(keys)
-        key_remove = set()
-    
-    if not key_add and key_remove:
-        key_add = set(["all"])
+    if parsed_keys is None:
+        parsed_keys = parse_keys(keys)
+    key_add, key_remove = parsed_keys
         
     d_keys = set(d)
     keys_in_d = key_add.intersection(d_keys)
     keys_in_default = key_add - keys_in_d
     
-    if not keys_in_default.issubset(set(d[key_default])):
+    if not keys_in_default.issubset(d[key_default].keys()):
         raise RuntimeError("Some keys don't belong to d or d[key_default]")
     else:    
         d_merged = {}    
@@ -0,0 +1,102 @@
+"""
+Write-behind saving for 'savedata' (save_mode="background").
+Results are returned as soon as they are computed, while a bounded pool of threads serializes and compresses them.
+Until the write finishes, calls with the same saving path are served from the in-flight result.
+
+Pending writes are drained at exit. Call tidypath.flush() to wait for them explicitly and collect failed writes.
+"""
+import atexit
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor, wait
+from . import config
+
+class BackgroundWriter():
+    """
+    Bounded pool of background writers.
+
+    Attrs:
+        - max_workers:    number of writer threads.
+        - max_pending:    max number of results waiting to be written. Further submissions block until a slot is free,
+                          so memory does not grow unbounded when computing is faster than saving.
+    """
+    def __init__(self, max_workers=2, max_pending=16):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = {}   # saving path -> (token, result)
+        self._futures = set()
+        self.errors = {}     # saving path -> exception
+
+    def __len__(self):
+        return len(self._futures)
+
+    def get(self, path, default=None):
+        """Result being written to path, if any."""
+        entry = self._pending.get(path)
+        return default if entry is None else entry[1]
+
+    def submit(self, path, result, write):
+        """
+        Schedules write() (which stores result at path) in a background thread.
+        """
+        self._slots.acquire()
+        try:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tidypath-writer")
+                token = object()
+                future = self._executor.submit(self._run, path, write, token)
+                self._pending[path] = (token, result)
+                self._futures.add(future)
+            future.add_done_callback(self._discard)
+        except BaseException:
+            self._slots.release()
+            raise
+        return future
+
+    def _discard(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _run(self, path, write, token):
+        try:
+            write()
+        except Exception as e:
+            self.errors[path] = e
+            warnings.warn(f"Background saving of '{path}' failed: {e!r}", RuntimeWarning)
+        finally:
+            with self._lock:
+                entry = self._pending.get(path)
+                if entry is not None and entry[0] is token: # not superseded by a later submission
+                    del self._pending[path]
+            self._slots.release()
+
+    def flush(self, timeout=None, raise_errors=False):
+        """
+        Waits for the pending writes.
+
+        Attrs:
+            - timeout:        max waiting time (seconds). None => wait until all writes finish.
+            - raise_errors:   raise RuntimeError if some write failed.
+
+        Returns: dict {saving path: exception} of the writes that failed since the last flush.
+        """
+        with self._lock:
+            futures = set(self._futures)
+        wait(futures, timeout=timeout)
+        with self._lock:
+            errors, self.errors = self.errors, {}
+        if errors and raise_errors:
+            raise RuntimeError("Background saving failed for:\n{}".format("\n".join(f"- {path}: {e!r}" for path, e in errors.items())))
+        return errors
+
+writer = BackgroundWriter(max_workers=config.BACKGROUND_MAX_WORKERS, max_pending=config.BACKGROUND_MAX_PENDING)
+
+def flush(timeout=None, raise_errors=False):
+    """Waits for the results being saved in the background. See BackgroundWriter.flush."""
+    return writer.flush(timeout=timeout, raise_errors=raise_errors)
+
+atexit.register(flush)
@@ -9,9 +9,32 @@ To modify the default config, set the following environmental variables before i
 - TIDYPATH_KEYS_ADD_POSONLY_TO_ALL
 - TIDYPATH_EXT_DEFAULT_DATA
 - TIDYPATH_EXT_DEFAULT_FIG
+- TIDYPATH_CODEC_DEFAULT_DATA
+- TIDYPATH_AUTO_MIN_BYTES
+- TIDYPATH_AUTO_CODEC
 - TIDYPATH_FUNCNAME_IN_FILENAME_DEFAULT_DATA
 - TIDYPATH_FUNCNAME_IN_FILENAME_DEFAULT_FIG
 - TIDYPATH_RETURN_FIG_DEFAULT
+- TIDYPATH_MEMORY_CACHE_DEFAULT_DATA
+- TIDYPATH_MEMORY_CACHE_MAX_ENTRIES
+- TIDYPATH_MEMORY_CACHE_MAX_BYTES
+- TIDYPATH_LOCK_DEFAULT_DATA
+- TIDYPATH_LOCK_TIMEOUT
+- TIDYPATH_LOCK_STALE_TIMEOUT
+- TIDYPATH_MANIFEST_DEFAULT_DATA
+- TIDYPATH_MANIFEST_CHECKSUM
+- TIDYPATH_MANIFEST_REFRESH_INTERVAL
+- TIDYPATH_SAVE_MODE_DEFAULT_DATA
+- TIDYPATH_BACKGROUND_MAX_WORKERS
+- TIDYPATH_BACKGROUND_MAX_PENDING
+- TIDYPATH_BACKEND_DEFAULT_DATA
+- TIDYPATH_SQLITE_TIMEOUT
+- TIDYPATH_SHARD_LEVELS_DEFAULT_DATA
+- TIDYPATH_CONTENT_HASH_DEFAULT_DATA
+- TIDYPATH_ENCODER_MEMO_SIZE
+- TIDYPATH_VERIFY_DEFAULT_DATA
+- TIDYPATH_RECORD_ACCESS_DEFAULT_DATA
+- TIDYPATH_ACCESS_FLUSH_INTERVAL
 """
 
 import os
@@ -95,6 +118,12 @@ class _EnvReloader(object):
             """
             return str(x) if x is not None else None
 
+        def optional_float(x):
+            """'none' => None. Otherwise float(x)."""
+            if x is None or (isinstance(x, str) and x.lower() == "none"):
+                return None
+            return float(x)
+
         def to_bool(x):
             if isinstance(x, str):
                 if x.lower() in ["true", "t", "y", "yes"]:
@@ -117,12 +146,42 @@ class _EnvReloader(object):
 
         EXT_DEFAULT_DATA = _readenv("TIDYPATH_EXT_DEFAULT_DATA", str, "lzma")
         EXT_DEFAULT_FIG = _readenv("TIDYPATH_EXT_DEFAULT_FIG", str, "pdf")
+        CODEC_DEFAULT_DATA = _readenv("TIDYPATH_CODEC_DEFAULT_DATA", str, "lzma")
+        AUTO_MIN_BYTES = _readenv("TIDYPATH_AUTO_MIN_BYTES", int, 2**20)
+        AUTO_CODEC = _readenv("TIDYPATH_AUTO_CODEC", optional_str, None)
 
         FUNCNAME_IN_FILENAME_DEFAULT_DATA = _readenv("TIDYPATH_FUNCNAME_IN_FILENAME_DEFAULT_DATA", to_bool, False)
         FUNCNAME_IN_FILENAME_DEFAULT_FIG = _readenv("TIDYPATH_FUNCNAME_IN_FILENAME_DEFAULT_FIG", to_bool, True)
 
         RETURN_FIG_DEFAULT = _readenv("TIDYPATH_RETURN_FIG_DEFAULT", to_bool, False)
 
+        MEMORY_CACHE_DEFAULT_DATA = _readenv("TIDYPATH_MEMORY_CACHE_DEFAULT_DATA", to_bool, False)
+        MEMORY_CACHE_MAX_ENTRIES = _readenv("TIDYPATH_MEMORY_CACHE_MAX_ENTRIES", int, 128)
+        MEMORY_CACHE_MAX_BYTES = _readenv("TIDYPATH_MEMORY_CACHE_MAX_BYTES", int, 2**30)
+
+        LOCK_DEFAULT_DATA = _readenv("TIDYPATH_LOCK_DEFAULT_DATA", to_bool, True)
+        LOCK_TIMEOUT = _readenv("TIDYPATH_LOCK_TIMEOUT", optional_float, None)
+        LOCK_STALE_TIMEOUT = _readenv("TIDYPATH_LOCK_STALE_TIMEOUT", optional_float, 3600.0)
+
+        MANIFEST_DEFAULT_DATA = _readenv("TIDYPATH_MANIFEST_DEFAULT_DATA", to_bool, False)
+        MANIFEST_CHECKSUM = _readenv("TIDYPATH_MANIFEST_CHECKSUM", to_bool, True)
+        MANIFEST_REFRESH_INTERVAL = _readenv("TIDYPATH_MANIFEST_REFRESH_INTERVAL", float, 1.0)
+        VERIFY_DEFAULT_DATA = _readenv("TIDYPATH_VERIFY_DEFAULT_DATA", optional_str, None)
+
+        RECORD_ACCESS_DEFAULT_DATA = _readenv("TIDYPATH_RECORD_ACCESS_DEFAULT_DATA", to_bool, True)
+        ACCESS_FLUSH_INTERVAL = _readenv("TIDYPATH_ACCESS_FLUSH_INTERVAL", float, 10.0)
+
+        SAVE_MODE_DEFAULT_DATA = _readenv("TIDYPATH_SAVE_MODE_DEFAULT_DATA", str, "sync")
+        BACKGROUND_MAX_WORKERS = _readenv("TIDYPATH_BACKGROUND_MAX_WORKERS", int, 2)
+        BACKGROUND_MAX_PENDING = _readenv("TIDYPATH_BACKGROUND_MAX_PENDING", int, 16)
+
+        BACKEND_DEFAULT_DATA = _readenv("TIDYPATH_BACKEND_DEFAULT_DATA", str, "files")
+        SQLITE_TIMEOUT = _readenv("TIDYPATH_SQLITE_TIMEOUT", float, 60.0)
+
+        SHARD_LEVELS_DEFAULT_DATA = _readenv("TIDYPATH_SHARD_LEVELS_DEFAULT_DATA", int, 0)
+        CONTENT_HASH_DEFAULT_DATA = _readenv("TIDYPATH_CONTENT_HASH_DEFAULT_DATA", to_bool, False)
+        ENCODER_MEMO_SIZE = _readenv("TIDYPATH_ENCODER_MEMO_SIZE", int, 4096)
+
         # Inject the configuration values into the module globals
         for name, value in locals().copy().items():
             if name.isupper():
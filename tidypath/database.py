@@ -0,0 +1,170 @@
+"""
+SQLite storage backend for 'savedata' (backend="sqlite" or "sqlite_tree").
+Results are stored as blobs in a single database file instead of one file per call, so millions of small results
+do not exhaust inodes and listing them does not require scanning a directory.
+
+Keys are the filenames the 'files' backend would use (dict_to_id encoding + extension), relative to the directory of the database:
+    - 'sqlite':        one database per function directory. Key: filename.
+    - 'sqlite_tree':   one database for the whole data tree (see paths.root_dir). Key: path relative to the root ('/' separated).
+
+Values are pickled and compressed with the codec of the extension (see storage.register_codec).
+Databases run in WAL mode: readers in other threads/processes are not blocked by writers.
+"""
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from . import config, storage
+
+db_name = ".tidypath.sqlite"
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+class Database():
+    """
+    Key-value store of pickled results in an SQLite file. Connections are opened per thread (and per process).
+
+    Attrs:
+        - path:      path of the database file.
+        - timeout:   max waiting time (seconds) for the write lock of the database.
+    """
+    def __init__(self, path, timeout=60.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None) # autocommit, explicit transactions
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def __contains__(self, key):
+        return self.contains(key)
+
+    def contains(self, key):
+        return self.connection.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def get(self, key, default=None):
+        """Stored bytes for key."""
+        row = self.connection.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def put(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO entries (key, value, size, mtime) VALUES (?, ?, ?, ?)", (key, value, len(value), time.time()))
+
+    def delete(self, key):
+        self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def keys(self, prefix=""):
+        """Stored keys starting with prefix."""
+        if prefix:
+            rows = self.connection.execute("SELECT key FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+        else:
+            rows = self.connection.execute("SELECT key FROM entries")
+        return [row[0] for row in rows]
+
+    def stat(self, key):
+        """(size, mtime) of key, or None if it is not stored."""
+        return self.connection.execute("SELECT size, mtime FROM entries WHERE key = ?", (key,)).fetchone()
+
+    def rename(self, mapping, overwrite=False):
+        """
+        Renames keys {old_key: new_key} in a single transaction.
+        overwrite: whether to replace existing entries with the new keys. If False and some new key exists, raises RuntimeError and nothing is renamed.
+        """
+        if not mapping:
+            return
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            tmp_keys = {old: f"\0rename.{i}" for i, old in enumerate(mapping)} # two phases => chains and swaps of keys are safe
+            for old, tmp in tmp_keys.items():
+                connection.execute("UPDATE entries SET key = ? WHERE key = ?", (tmp, old))
+            for old, new in mapping.items():
+                if self.contains(new):
+                    if overwrite:
+                        self.delete(new)
+                    else:
+                        raise RuntimeError(f"'{new}' already existing before renaming '{old}'. To delete repeated entries pass 'overwrite=True'.")
+                connection.execute("UPDATE entries SET key = ? WHERE key = ?", (new, tmp_keys[old]))
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return
+
+def get_database(directory):
+    """Database stored in directory, shared within the process. Created if it does not exist."""
+    key = os.path.abspath(directory)
+    database = _databases.get(key)
+    if database is None:
+        with _databases_lock:
+            database = _databases.get(key)
+            if database is None:
+                os.makedirs(directory, exist_ok=True)
+                database = Database(os.path.join(directory, db_name), timeout=config.SQLITE_TIMEOUT)
+                _databases[key] = database
+    return database
+
+def find_database(directory):
+    """
+    Database containing the entries of directory: stored in directory or in one of its parents ('sqlite_tree').
+    Returns: (Database, key prefix of the entries of directory) or (None, None) if there is no database.
+    """
+    directory = os.path.abspath(directory)
+    parent = directory
+    while True:
+        if os.path.exists(os.path.join(parent, db_name)):
+            prefix = os.path.relpath(directory, parent).replace(os.sep, "/")
+            return get_database(parent), ("" if prefix == "." else f"{prefix}/")
+        new_parent = os.path.dirname(parent)
+        if new_parent == parent:
+            return None, None
+        parent = new_parent
+
+def location(saving_path, root=None):
+    """
+    (database directory, key) of saving_path.
+    root: directory of the database for 'sqlite_tree'. None => database in the directory of saving_path ('sqlite').
+    """
+    if root is None:
+        return os.path.dirname(saving_path), os.path.basename(saving_path)
+    else:
+        return root, os.path.relpath(saving_path, root).replace(os.sep, "/")
+
+def codec_of(ext, codec=None):
+    """Codec used for storing results with extension ext. 'pkl' => codec (default config.CODEC_DEFAULT_DATA)."""
+    if ext == "pkl":
+        return storage.get_codec(config.CODEC_DEFAULT_DATA if codec is None else codec)
+    for registered in storage.codecs.values():
+        if registered.ext == ext:
+            return registered
+    if ext in storage.codecs: # codec name. Example: 'bz2'
+        return storage.codecs[ext]
+    raise ValueError(f"ext '{ext}' not valid for the sqlite backend. Available: 'pkl' and codec extensions {sorted({c.ext for c in storage.codecs.values() if c.ext is not None})}.")
+
+def dumps(data, ext, codec=None, level=None, threads=None, **kwargs):
+    """
+    Pickles and compresses data with the codec of ext.
+    kwargs: other saving options. Ignored.
+    """
+    return codec_of(ext, codec).compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), level=level, threads=threads)
+
+def loads(value, **kwargs):
+    """
+    Inverse of dumps. The codec is detected from the leading bytes.
+    kwargs: loading options. Ignored.
+    """
+    return pickle.loads(storage.detect_codec(value[:8]).decompress(value))
@@ -6,12 +6,10 @@ import inspect
 import warnings
 import os
 from pathlib import Path
-from functools import wraps
+from functools import wraps, partial
 from collections.abc import Iterable
 from importlib.util import find_spec
 from ._helper import NoFigure
-from lzma import LZMAError
-import _lzma
 if find_spec("plotly") is None:
     plotly_figure = NoFigure
 else:
@@ -22,14 +20,18 @@ else:
     from matplotlib.figure import Figure as mpl_figure
     import matplotlib.pyplot as plt
 
-from . import storage, config
-from .paths import datapath, figpath, hash_path
-from .inspection import classify_call_attrs, merge_wrapper_signatures
-from ._helper import merge_nested_dict
+from . import storage, config, memory, locking, parallel, background, database, query, integrity, eviction
+from .manifest import get_manifest
+from .hash_index import record_hash
+from .paths import datapath, figpath, hash_path, root_dir
+from .inspection import classify_call_attrs, compile_call_plan, merge_wrapper_signatures
+from ._helper import merge_nested_dict, parse_keys
 
 class SavedataSkippedComputation:
     pass
 
+_missing = object()
+
 def _preprocess_keys_or_function(keys_or_function, keys, extra_keys):
     if isinstance(keys_or_function, Iterable):
         func = None
@@ -51,6 +53,15 @@ def savedata(keys_or_function=None, include_classes="file",
              max_str_length=255,
              skip_computation=False,
              iterable_maxsize=math.inf,
+             memory_cache=config.MEMORY_CACHE_DEFAULT_DATA,
+             lock=config.LOCK_DEFAULT_DATA,
+             manifest=config.MANIFEST_DEFAULT_DATA,
+             save_mode=config.SAVE_MODE_DEFAULT_DATA,
+             backend=config.BACKEND_DEFAULT_DATA,
+             shard_levels=config.SHARD_LEVELS_DEFAULT_DATA,
+             content_hash=config.CONTENT_HASH_DEFAULT_DATA,
+             verify=config.VERIFY_DEFAULT_DATA,
+             record_access=config.RECORD_ACCESS_DEFAULT_DATA,
              load_opts={}, **save_opts):
     """
     Decorator for automatically saving output and then loading cached data.
@@ -78,9 +89,25 @@ def savedata(keys_or_function=None, include_classes="file",
         - extra_keys (dict):         additional keys to be included in the filename. They do not have to be arguments of the function.
         - skip_computation (bool).     whether to skip computation if the data is not stored.
         - ext (str/list/tuple):    storing extension. Selects 'storage' functions save_ext, load_ext.
-                                   Supported: 'lzma' (default), 'bz2', 'json', 'csv', 'npz'.
+                                   Supported: 'lzma' (default), 'bz2', 'json', 'csv', 'npz', 'npy', 'npydir',
+                                              'pkl' (pickle compressed with the codec given by save_opts 'codec', default config.CODEC_DEFAULT_DATA),
+                                              'gz', 'zst' (zstandard installed), 'lz4' (lz4 installed) and extensions of codecs added by storage.register_codec.
+                                   Compressed pickles accept the save_opts 'level' and 'threads' (zstd only).
+                                   'pkl5': uncompressed pickle with out-of-band buffers. Large arrays are neither copied on saving nor on loading
+                                           (load_opts: mmap_mode='r' for memory-mapped loading).
+                                   'parquet', 'feather': DataFrames in columnar format (requires pyarrow, otherwise they are pickled).
+                                                         load_opts 'columns' and 'filters' load a subset of columns/rows.
+                                   'npy' (array) and 'npydir' (dict of arrays) are uncompressed and loaded memory-mapped by default (load_opts: mmap_mode).
+                                   'auto': format chosen from the type and size of the result (see storage.auto_format): 'npy' for large arrays,
+                                           'parquet' for DataFrames, 'pkl5' for other large objects and a fast codec for small ones.
         - return_path (bool).      whether to return the path of the saved data.
 
+    NOTE (!) decorated funcs will have the method:
+        - map(grid, n_jobs=None, backend="process", ordered=True, **call_opts):   evaluate the function over a parameter grid in parallel.
+                                                                                  See tidypath.parallel.map_grid.
+        - cached(ext=None, **partial_key):                                        stored results matching a partial key, e.g. func.cached(z=1).
+                                                                                  See tidypath.query.CachedResults.
+
     Attrs:
         - function:                function to which the decorator is applied
         - include_classes:         include class tree in saving_path.
@@ -89,6 +116,39 @@ def savedata(keys_or_function=None, include_classes="file",
         - load_opts_default_save:  use save_opts as default for load_opts.
         - max_str_length:          max length of filename. If exceeded, filename is shortened by hashing it.
         - iterable_maxsize:        max size of iterable keys. If exceeded, keys are shortened by counting val numbers.
+        - content_hash:            encode arrays, DataFrames/Series (any size) and iterables exceeding iterable_maxsize by a digest of their content
+                                   (see fmt.content_digest). Different inputs of the same length => different files.
+        - memory_cache:            keep results in an in-process LRU cache (tidypath.memory.memory_cache) keyed by saving path.
+                                   Repeated hits are served from memory while the file mtime and size do not change. Limits are set by
+                                   config.MEMORY_CACHE_MAX_ENTRIES and config.MEMORY_CACHE_MAX_BYTES.
+                                   NOTE: cached results are shared between calls. Do not modify them in place.
+        - lock:                    single-flight computation. Before computing, acquire a lock file next to the saving path (tidypath.locking.FileLock).
+                                   Concurrent callers with the same key wait and then load the stored result instead of recomputing.
+                                   Waiting time and stale-lock breaking are set by config.LOCK_TIMEOUT and config.LOCK_STALE_TIMEOUT.
+        - manifest:                decide hits/misses from the manifest of the function directory (tidypath.manifest) instead of probing the filesystem.
+                                   The manifest is updated on every save. Directories populated without it are indexed on first use
+                                   (see tidypath.manifest.rebuild_manifest).
+        - save_mode:               'sync'        => save the result before returning it.
+                                   'background'  => return the result right away and save it in a background thread (tidypath.background).
+                                                    Calls with the same key are served from the in-flight result until it is written.
+                                                    Use tidypath.flush() to wait for pending writes and collect failures (also done at exit).
+        - backend:                 'files'        => one file per call.
+                                   'sqlite'       => results stored as blobs in an SQLite database in the function directory (tidypath.database).
+                                   'sqlite_tree'  => single SQLite database for the whole data tree (see tidypath.paths.root_dir).
+                                   SQLite backends avoid one file per call (millions of small results). Keys are the filenames of the 'files' backend,
+                                   values are pickled and compressed with the codec of ext (codec extensions or 'pkl'). return_path returns the key paths.
+                                   The manifest and the memory cache only apply to the 'files' backend.
+        - shard_levels:            'files' backend. Fan out the outputs into hash-prefix subdirectories (func_dir/ab/cd/filename for 2 levels)
+                                   instead of a flat directory. Applies to new function directories. The layout is recorded in the directory
+                                   ('.tidypath_layout') and always followed when loading. Existing directories: see tidypath.paths.migrate_layout.
+        - verify:                  'files' backend. Check stored files on hits against the size and checksum recorded in the manifest when they were saved,
+                                   before loading them. Mismatches are handled as corrupted files (recomputed and stored).
+                                   None => no check. 'size' => compare sizes (one stat). 'checksum' => also compare checksums (reads the whole file).
+                                   Saves are recorded in the manifest. Files saved without it are not checked. See also tidypath.integrity.verify.
+        - record_access:           'files' backend. Record hits in the access journal of the directory ('.tidypath_access'), used by the garbage collector
+                                   to evict the least recently used entries (see tidypath.eviction.collect_garbage). On by default.
+                                   Without it, recency is the mtime (entries are evicted in write order).
+                                   Hits are buffered and written every config.ACCESS_FLUSH_INTERVAL seconds.
         - rest:                    default behavior for decorated funcs extra arguments (above).
 
     Returns: Function decorator
@@ -97,31 +157,140 @@ def savedata(keys_or_function=None, include_classes="file",
 
     if load_opts_default_save:
         load_opts = {**save_opts, **load_opts}
+    if backend not in ("files", "sqlite", "sqlite_tree"):
+        raise ValueError(f"backend '{backend}' not valid. Available: 'files', 'sqlite', 'sqlite_tree'.")
+    if save_mode not in ("sync", "background"):
+        raise ValueError(f"save_mode '{save_mode}' not valid. Available: 'sync', 'background'.")
+    if verify not in (None, "size", "checksum"):
+        raise ValueError(f"verify '{verify}' not valid. Available: None, 'size', 'checksum'.")
+
+    ext_default = ext
 
     def _savedata(func):
+        plan = compile_call_plan(func)
+        db_root = root_dir(func) if backend == "sqlite_tree" else None
+
+        def load(ext, saving_path):
+            if backend == "files":
+                if verify is not None:
+                    integrity.check_file(saving_path, checksum=verify == "checksum")
+                return getattr(storage, f"load_{ext}")(saving_path, **load_opts)
+            else:
+                db_dir, key = database.location(saving_path, db_root)
+                value = database.get_database(db_dir).get(key)
+                if value is None:
+                    raise FileNotFoundError(f"'{key}' not stored in '{db_dir}'.")
+                return database.loads(value, **load_opts)
+
+        def exists(saving_path):
+            """Whether a result is stored at saving_path, whatever the backend."""
+            if backend != "files":
+                db_dir, key = database.location(saving_path, db_root)
+                return database.get_database(db_dir).contains(key)
+            elif manifest:
+                return get_manifest(os.path.dirname(saving_path)).contains(os.path.basename(saving_path))
+            else:
+                return Path(saving_path).exists()
+
+        def touch(saving_path):
+            """Records a hit (see tidypath.eviction)."""
+            if record_access and backend == "files":
+                eviction.access_log.record(saving_path)
+        default_keys = keys
+        default_parsed_keys = parse_keys(keys)
+
         @wraps(func)
         def wrapper(*args, overwrite=overwrite, keys=keys, extra_keys=extra_keys, save=save, funcname_in_filename=funcname_in_filename, skip_computation=skip_computation, ext=ext, return_path=return_path, **kwargs):
-            key_opts = classify_call_attrs(func, args, kwargs, add_pos_only_to_all=config.KEYS_ADD_POSONLY_TO_ALL)
-            save_keys = merge_nested_dict(key_opts, keys, key_default="all")
+            key_opts = classify_call_attrs(func, args, kwargs, add_pos_only_to_all=config.KEYS_ADD_POSONLY_TO_ALL, plan=plan)
+            parsed_keys = default_parsed_keys if keys is default_keys else parse_keys(keys)
+            save_keys = merge_nested_dict(key_opts, keys, key_default="all", parsed_keys=parsed_keys)
             if extra_keys:
                 save_keys = {**extra_keys, **save_keys}
 
+            originals = {} # hashed saving_path -> original filename. Recorded in the hash index once the result is stored.
             def get_saving_path(ext):
-                saving_path = datapath(keys=save_keys, func=func, ext=ext, include_classes=include_classes, funcname_in_filename=funcname_in_filename, iterable_maxsize=iterable_maxsize)
+                saving_path = datapath(keys=save_keys, func=func, ext=ext, include_classes=include_classes, funcname_in_filename=funcname_in_filename, iterable_maxsize=iterable_maxsize,
+                                       shard_levels=shard_levels, layout=backend == "files", content_hash=content_hash)
                 filename = os.path.basename(saving_path)
                 if len(filename) + len(ext) + 1 > max_str_length:
                     saving_path = hash_path(saving_path)
+                    originals[saving_path] = filename
                     warnings.warn("Filename too long. Hashing it ...", RuntimeWarning)
                 return saving_path
 
+            def save_result(result, ext, saving_path):
+                if backend == "files":
+                    getattr(storage, f"save_{ext}")(result, saving_path, **save_opts)
+                else:
+                    db_dir, key = database.location(saving_path, db_root)
+                    database.get_database(db_dir).put(key, database.dumps(result, ext, **save_opts))
+                if saving_path in originals:
+                    record_hash(os.path.dirname(saving_path), os.path.basename(saving_path), originals[saving_path])
+
+            def record(saving_path, update=True):
+                """Adds saving_path to the manifest. update=False => only if not recorded yet."""
+                if (manifest or verify is not None) and backend == "files":
+                    directory_manifest = get_manifest(os.path.dirname(saving_path))
+                    filename = os.path.basename(saving_path)
+                    if update or not directory_manifest.contains(filename):
+                        directory_manifest.record(filename)
+
             result = None
-            def compute(result, ext, saving_path):
-                if result is None:
-                    result = func(*args, **kwargs)
+            def compute(result, ext, saving_path, file_lock=None):
+                """Computes (if needed) and stores the result. file_lock is released once the result is stored."""
+                release = (lambda: None) if file_lock is None else file_lock.release
+                try:
+                    if result is None:
+                        result = func(*args, **kwargs)
+                except BaseException:
+                    release()
+                    raise
                 if save:
-                    getattr(storage, f"save_{ext}")(result, saving_path, **save_opts)
+                    def store():
+                        try:
+                            save_result(result, ext, saving_path)
+                            record(saving_path)
+                            if memory_cache:
+                                memory.memory_cache.put(saving_path, result)
+                        finally:
+                            release()
+                    if save_mode == "background":
+                        background.writer.submit(saving_path, result, store)
+                    else:
+                        store()
+                else:
+                    release()
+                    if memory_cache:
+                        memory.memory_cache.invalidate(saving_path)
                 return result
 
+            def locked_compute(result, ext, saving_path, check_exists=True):
+                """Computes holding the lock of saving_path. If another process stored the data in the meantime, it is loaded instead."""
+                if not (lock and save and result is None):
+                    return compute(result, ext, saving_path)
+                Path(saving_path).parent.mkdir(exist_ok=True, parents=True)
+                file_lock = locking.FileLock(locking.lock_path(saving_path), timeout=config.LOCK_TIMEOUT, stale_timeout=config.LOCK_STALE_TIMEOUT)
+                try:
+                    file_lock.acquire()
+                except TimeoutError:
+                    warnings.warn("Could not acquire lock. Computing without it ...", RuntimeWarning)
+                    return compute(result, ext, saving_path)
+                if check_exists and not overwrite and (Path(saving_path).exists() if backend == "files" else exists(saving_path)):
+                    try:
+                        result = load(ext, saving_path)
+                        record(saving_path, update=False)
+                        touch(saving_path)
+                        if memory_cache:
+                            memory.memory_cache.put(saving_path, result)
+                        file_lock.release()
+                        return result
+                    except KeyboardInterrupt:
+                        file_lock.release()
+                        raise KeyboardInterrupt
+                    except Exception:
+                        warnings.warn("Corrupted file. Recomputing and storing ...", RuntimeWarning)
+                return compute(result, ext, saving_path, file_lock=file_lock)
+
             if isinstance(ext, str):
                 ext = [ext]
 
@@ -130,35 +299,56 @@ def savedata(keys_or_function=None, include_classes="file",
             else:
                 for ext_i in ext:
                     saving_path = get_saving_path(ext_i)
-                    if skip_computation and not Path(saving_path).exists():
+                    if not overwrite:
+                        result_i = background.writer.get(saving_path, _missing)
+                        if result_i is not _missing: # being saved in the background
+                            result = result_i
+                            continue
+                    if memory_cache and not overwrite:
+                        result_i = memory.memory_cache.get(saving_path, _missing)
+                        if result_i is not _missing:
+                            result = result_i
+                            touch(saving_path)
+                            continue
+                    if skip_computation and not exists(saving_path):
                         warnings.warn("Skipping computation. Data not stored.", RuntimeWarning)
                         return SavedataSkippedComputation()
-                    elif Path(saving_path).exists() and not overwrite:
+                    elif not overwrite and exists(saving_path):
                         try:
-                            result = getattr(storage, f"load_{ext_i}")(saving_path, **load_opts)
-                        except EOFError or LZMAError or _lzma.LZMAError:
-                            if skip_computation:
-                                warnings.warn("Corrupted file. Skipping computation ...", RuntimeWarning)
-                                return SavedataSkippedComputation()
-                            else:
-                                warnings.warn("Corrupted file. Recomputing and storing ...", RuntimeWarning)
-                                result = compute(result, ext_i, saving_path)
+                            signature = memory.file_signature(saving_path) if memory_cache else None
+                            result = load(ext_i, saving_path)
+                            if memory_cache and signature is not None:
+                                memory.memory_cache.put(saving_path, result, signature=signature)
+                            touch(saving_path)
                         except KeyboardInterrupt:
                             raise KeyboardInterrupt
-                        except Exception as e:
-                            print(e)
+                        except Exception as e: # corrupted or truncated file (EOFError, LZMAError, UnpicklingError, integrity.CorruptedFileError, ...)
                             if skip_computation:
-                                warnings.warn("Corrupted file. Skipping computation ...", RuntimeWarning)
+                                warnings.warn(f"Corrupted file ({type(e).__name__}: {e}). Skipping computation ...", RuntimeWarning)
                                 return SavedataSkippedComputation()
                             else:
-                                warnings.warn("Corrupted file. Recomputing and storing ...", RuntimeWarning)
-                                result = compute(result, ext_i, saving_path)
+                                warnings.warn(f"Corrupted file ({type(e).__name__}: {e}). Recomputing and storing ...", RuntimeWarning)
+                                result = locked_compute(result, ext_i, saving_path, check_exists=False)
                     else:
-                        result = compute(result, ext_i, saving_path)
+                        result = locked_compute(result, ext_i, saving_path)
                 return result
 
         wrapper.__signature__ = merge_wrapper_signatures(wrapper, ["overwrite", "keys", "save", "funcname_in_filename", "skip_computation", "ext", "return_path"])
         wrapper.__out__ = "data"
+        wrapper.max_str_length = max_str_length
+        wrapper._is_stored = exists
+        wrapper.map = partial(parallel.map_grid, wrapper)
+
+        def cached(ext=None, **partial_key):
+            """
+            Stored results whose key matches partial_key. Example: func.cached(z=1) => results for z=1 and any value of the other args.
+            ext: extension(s) of the results. None => ext of the decorator.
+            Returns: tidypath.query.CachedResults (table of keys and paths, load(n_jobs) for loading them).
+            """
+            directory = datapath(func=func, include_classes=include_classes, return_dir=True)
+            return query.cached_results(directory, partial_key, ext_default if ext is None else ext, load,
+                                        backend=backend, db_root=db_root, iterable_maxsize=iterable_maxsize, content_hash=content_hash)
+        wrapper.cached = cached
         return wrapper
 
     if func is None:
@@ -216,20 +406,27 @@ def savefig(keys_or_function=None, include_classes="file",
     mpl_save_defaults = dict(bbox_inches="tight")
 
     def _savefig(func):
+        plan = compile_call_plan(func)
+        default_keys = keys
+        default_parsed_keys = parse_keys(keys)
+
         @wraps(func)
         def wrapper(*args, overwrite=overwrite, keys=keys, save=save, return_fig=return_fig, funcname_in_filename=funcname_in_filename, ext=ext, **kwargs):
             fig = func(*args, **kwargs)
             is_mpl_axes = type(fig).__name__ == 'AxesSubplot'
             if isinstance(fig, (mpl_figure, plotly_figure)) or is_mpl_axes:
-                key_opts = classify_call_attrs(func, args, kwargs, add_pos_only_to_all=config.KEYS_ADD_POSONLY_TO_ALL)
-                save_keys = merge_nested_dict(key_opts, keys, key_default="all")
+                key_opts = classify_call_attrs(func, args, kwargs, add_pos_only_to_all=config.KEYS_ADD_POSONLY_TO_ALL, plan=plan)
+                parsed_keys = default_parsed_keys if keys is default_keys else parse_keys(keys)
+                save_keys = merge_nested_dict(key_opts, keys, key_default="all", parsed_keys=parsed_keys)
                 if extra_keys:
                     save_keys = {**extra_keys, **save_keys}
+                originals = {} # hashed saving_path -> original filename. Recorded in the hash index once the figure is saved.
                 def get_saving_path(ext):
                     saving_path = figpath(keys=save_keys, func=func, ext=ext, include_classes=include_classes, funcname_in_filename=funcname_in_filename, iterable_maxsize=iterable_maxsize)
                     filename = os.path.basename(saving_path)
                     if len(filename) + len(ext) + 1 > max_str_length:
                         saving_path = hash_path(saving_path)
+                        originals[saving_path] = filename
                         warnings.warn("Filename too long. Hashing it ...", RuntimeWarning)
                     return saving_path
 
@@ -252,6 +449,8 @@ def savefig(keys_or_function=None, include_classes="file",
                                     fig.write_image(saving_path, format=ext_i, **save_opts)
                             else:
                                 raise TypeError(f"fig type '{type(fig)}' not valid. Available: 'matplotlib.figure.Figure', 'matplotlib.axes._subplots.AxesSubplot', 'plotly.grap_objs._figure.Figure'.")
+                            if saving_path in originals:
+                                record_hash(os.path.dirname(saving_path), os.path.basename(saving_path), originals[saving_path])
 
 
                 if return_fig:
@@ -267,6 +466,7 @@ def savefig(keys_or_function=None, include_classes="file",
 
         wrapper.__signature__ = merge_wrapper_signatures(wrapper, ["overwrite", "keys", "save", "funcname_in_filename", "return_fig", "ext"])
         wrapper.__out__ = "figure"
+        wrapper.max_str_length = max_str_length
         return wrapper
 
     if func is None:
@@ -0,0 +1,263 @@
+"""
+Garbage collection of the data tree: byte quotas per function directory and for the whole tree, enforced by evicting the least recently used entries.
+
+Recency is recorded by 'savedata' on every hit (record_access=True, on by default), so it does not depend on filesystem atime
+(often disabled or coarse). Hits are buffered in memory and appended to an access journal ('.tidypath_access', see tidypath.journal)
+in the directory of the entries every config.ACCESS_FLUSH_INTERVAL seconds and at exit. Journals are compacted by every collection pass.
+Entries without recorded accesses (saved with record_access=False, or never hit) use their mtime: with record_access=False, entries are
+evicted in write order, however often they are loaded.
+
+    - collect_garbage:   single pass. Returns a report of the evicted entries (dry_run => nothing is deleted).
+    - GarbageCollector:  runs collect_garbage periodically in a background thread (see start_gc).
+"""
+import os
+import json
+import time
+import atexit
+import shutil
+import threading
+import warnings
+import pandas as pd
+from collections import defaultdict
+from . import config
+from .manifest import get_manifest, manifest_name
+from .paths import func_directory, dataDir, layout_name, _SHARD
+from .journal import Journal
+from .scan import scan
+
+access_name = ".tidypath_access"
+
+##############################################################################################################################
+"""                                                  I. Access journal                                                     """
+##############################################################################################################################
+
+class AccessLog():
+    """
+    Buffered record of the hits served by 'savedata'.
+
+    Attrs:
+        - flush_interval:   min time (seconds) between writes of the buffered hits to the access journals.
+    """
+    def __init__(self, flush_interval=10.0):
+        self.flush_interval = flush_interval
+        self._pending = defaultdict(dict) # directory -> {filename: time}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, path):
+        """Records a hit of the entry at path."""
+        directory, filename = os.path.split(path)
+        with self._lock:
+            self._pending[directory][filename] = time.time()
+        if time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Appends the buffered hits to the access journals."""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(dict)
+            self._last_flush = time.monotonic()
+        for directory, accesses in pending.items():
+            try:
+                Journal(os.path.join(directory, access_name)).append([dict(f=f, t=t) for f, t in accesses.items()])
+            except OSError: # directory removed
+                pass
+        return
+
+access_log = AccessLog(flush_interval=config.ACCESS_FLUSH_INTERVAL)
+atexit.register(access_log.flush)
+
+def _read_access(directory):
+    """({filename: time of the last recorded hit}, number of records, number of corrupted lines) of the access journal of directory."""
+    records, _, n_bad = Journal(os.path.join(directory, access_name)).read()
+    accesses = {}
+    for record in records:
+        if record.get("t", -float("inf")) > accesses.get(record.get("f"), -float("inf")):
+            accesses[record["f"]] = record["t"]
+    return accesses, len(records), n_bad
+
+def load_access(directory):
+    """{filename: time of the last recorded hit} of directory."""
+    return _read_access(directory)[0]
+
+def compact_access(directory, filenames):
+    """Rewrites the access journal of directory keeping the last hit of filenames (the entries still stored)."""
+    accesses = load_access(directory)
+    Journal(os.path.join(directory, access_name)).rewrite([dict(f=k, t=accesses[k]) for k in filenames if k in accesses])
+    return
+
+##############################################################################################################################
+"""                                                 II. Garbage collection                                                 """
+##############################################################################################################################
+
+def _sharded_dirs(hidden_records):
+    """{directory: shard levels} of the directories with a hash-prefix layout."""
+    sharded = {}
+    for record in hidden_records:
+        if record.name == layout_name:
+            with open(record.path, 'r') as f:
+                levels = json.load(f)["shard_levels"]
+            if levels > 0:
+                sharded[os.path.dirname(record.path)] = levels
+    return sharded
+
+def _function_dir(directory, sharded):
+    """Function directory of the entries in directory (skipping hash-prefix shards)."""
+    parent = directory
+    for level in range(1, max(sharded.values(), default=0) + 1):
+        parent, name = os.path.split(parent)
+        if _SHARD.fullmatch(name) is None:
+            break
+        if sharded.get(parent) == level:
+            return parent
+    return directory
+
+def inventory(root, n_jobs=1):
+    """
+    Stored entries under root: files and directories with an extension ('npydir' outputs). Hidden files and directories are skipped.
+    Returns: DataFrame with columns path, func_dir, size, mtime, last_access (last recorded hit, or mtime).
+    """
+    return _inventory(root, n_jobs=n_jobs)[0]
+
+def _inventory(root, n_jobs=1):
+    """(inventory, {directory: whether its access journal needs compaction})."""
+    entries = {} # path -> [size, mtime]
+    hidden = []
+    for record in scan(root, recursive=True, n_jobs=n_jobs):
+        rel_parts = os.path.relpath(record.path, root).split(os.sep)
+        if any(part.startswith(".") for part in rel_parts[:-1]): # quarantine, temporary directories
+            continue
+        elif rel_parts[-1].startswith("."):
+            hidden.append(record)
+            continue
+        dir_parts = [i for i, part in enumerate(rel_parts[:-1]) if "." in part]
+        path = os.path.join(root, *rel_parts[:dir_parts[0] + 1]) if dir_parts else record.path
+        entry = entries.setdefault(path, [0, 0.0])
+        entry[0] += record.size
+        entry[1] = max(entry[1], record.mtime)
+    sharded = _sharded_dirs(hidden)
+    accesses = {}
+    journals = {}
+    for record in hidden:
+        if record.name == access_name:
+            directory = os.path.dirname(record.path)
+            accesses[directory], n_records, n_bad = _read_access(directory)
+            journals[directory] = n_bad > 0 or n_records > len(accesses[directory])
+    rows = []
+    for path, (size, mtime) in entries.items():
+        directory, filename = os.path.split(path)
+        last_access = max(mtime, accesses.get(directory, {}).get(filename, mtime))
+        rows.append((path, _function_dir(directory, sharded), size, mtime, last_access))
+    return pd.DataFrame(rows, columns=["path", "func_dir", "size", "mtime", "last_access"]), journals
+
+def _remove_entry(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+    directory, filename = os.path.split(path)
+    if os.path.exists(os.path.join(directory, manifest_name)):
+        get_manifest(directory).remove(filename)
+    return
+
+def collect_garbage(func_or_directory=None, quota=None, func_quota=None, quotas={}, min_age=60.0, max_evictions=None, dry_run=False, n_jobs=1):
+    """
+    Evicts the least recently used entries until the byte quotas are met.
+
+    Attrs:
+        - func_or_directory:   function (wrapped by savedata) or directory to collect. None => whole data tree (paths.dataDir).
+        - quota:               max bytes of all the entries under the directory. None => no global quota.
+        - func_quota:          max bytes of each function directory. None => no per-function quota.
+        - quotas:              {function or function directory: max bytes}. Overrides func_quota.
+        - min_age:             entries accessed (or modified) in the last min_age seconds are never evicted.
+        - max_evictions:       max number of entries deleted in this pass. None => no limit. Use it for incremental collection:
+                               the next pass continues with the least recently used entries left.
+        - dry_run:             report the entries that would be evicted without deleting them. Access journals are not compacted.
+        - n_jobs:              number of threads scanning the tree (see tidypath.scan.scan).
+
+    Function quotas are applied first, then the global quota.
+    Returns: DataFrame of the evicted entries, least recently used first. Columns: path, func_dir, size, mtime, last_access, reason, deleted, error.
+    """
+    root = dataDir if func_or_directory is None else func_directory(func_or_directory)
+    columns = ["path", "func_dir", "size", "mtime", "last_access", "reason", "deleted", "error"]
+    if not os.path.isdir(root):
+        return pd.DataFrame(columns=columns)
+    access_log.flush()
+    table, journals = _inventory(root, n_jobs=n_jobs)
+    table = table.sort_values("last_access", kind="stable", ignore_index=True)
+    evictable = table["last_access"] < time.time() - min_age
+
+    reason = pd.Series(None, index=table.index, dtype=object)
+    func_quotas = {os.path.abspath(func_directory(k)): v for k, v in quotas.items()}
+    for func_dir, group in table.groupby("func_dir", sort=False):
+        limit = func_quotas.get(os.path.abspath(func_dir), func_quota)
+        if limit is None:
+            continue
+        excess = group["size"].sum() - limit
+        candidates = group.index[evictable[group.index]]
+        n = (table.loc[candidates, "size"].cumsum() < excess).sum() + 1 if excess > 0 else 0 # evict until excess <= 0
+        reason[candidates[:n]] = "function quota"
+    if quota is not None:
+        excess = table["size"][reason.isna()].sum() - quota
+        if excess > 0:
+            candidates = table.index[evictable & reason.isna()]
+            n = (table.loc[candidates, "size"].cumsum() < excess).sum() + 1
+            reason[candidates[:n]] = "global quota"
+
+    evicted = table[reason.notna()].assign(reason=reason[reason.notna()], deleted=False, error=None)
+    if max_evictions is not None:
+        evicted = evicted.iloc[:max_evictions]
+    if not dry_run:
+        for i, path in zip(evicted.index, evicted["path"]):
+            try:
+                _remove_entry(path)
+                evicted.at[i, "deleted"] = True
+            except OSError as e:
+                evicted.at[i, "error"] = str(e)
+        deleted = evicted["path"][evicted["deleted"]]
+        kept = table["path"][~table["path"].isin(deleted)]
+        kept_dirs = kept.map(os.path.dirname)
+        for directory in deleted.map(os.path.dirname).unique():
+            if directory in journals:
+                journals[directory] = True
+        for directory, needs_compaction in journals.items(): # drop repeated hits and hits of evicted entries
+            if needs_compaction:
+                compact_access(directory, kept[kept_dirs == directory].map(os.path.basename))
+    return evicted[columns].reset_index(drop=True)
+
+class GarbageCollector():
+    """
+    Runs collect_garbage every 'interval' seconds in a daemon thread. Failed passes are reported as warnings.
+
+    Attrs:
+        - interval:   time (seconds) between passes.
+        - kwargs:     passed to collect_garbage. Combine with max_evictions for short, incremental passes.
+    """
+    def __init__(self, interval=600.0, **kwargs):
+        self.interval = interval
+        self.kwargs = kwargs
+        self.report = None # report of the last pass
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="tidypath-gc", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stops the collector after the current pass."""
+        self._stop.set()
+        self._thread.join(timeout)
+        return
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.report = collect_garbage(**self.kwargs)
+            except Exception as e:
+                warnings.warn(f"Garbage collection failed: {e!r}", RuntimeWarning)
+            self._stop.wait(self.interval)
+
+def start_gc(interval=600.0, **kwargs):
+    """Starts a background GarbageCollector. Returns it (call .stop() to end it). kwargs: see collect_garbage."""
+    return GarbageCollector(interval=interval, **kwargs).start()
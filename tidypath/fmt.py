@@ -3,9 +3,27 @@ Encode dictionaries in strings and decode them. Useful for automatically asignin
 Includes hashing.
 """
 import numpy as np
+import pandas as pd
+import re
 import math
 import os
 import hashlib
+import mmap
+import pickle
+import weakref
+from functools import lru_cache
+from importlib.util import find_spec
+from concurrent.futures import ThreadPoolExecutor
+from . import config
+from .hash_index import original_filename
+from .scan import scan
+
+_HAVE_XXHASH = find_spec("xxhash") is not None
+if _HAVE_XXHASH:
+    import xxhash
+
+_missing = object()
+_SCALARS = (int, float, complex, str, bytes, bool, type(None))
 
 ##############################################################################################################################
 """                                                  I. Getopt utils                                                       """
@@ -26,92 +44,226 @@ invalid_str = {'<': 'lthan',
 # str.translate() requires dict keys to be integer Unicode ordinals.
 STR_TRANS_TABLE = {ord(key): value for key, value in invalid_str.items()}
 
-def encoder(x, ndigits=2, iterables=(list, tuple, np.ndarray), iterable_maxsize=3):
-    """x -> string version of x"""
-    if isinstance(x, float):
-        if math.isinf(x) or math.isnan(x):
-            return str(x)
-        elif x == int(x):
-            return str(int(x))
-        else:
-            return str(round(x, ndigits=ndigits)).replace('.', '--')
-    elif isinstance(x, int):
+_ITERABLES = (list, tuple, np.ndarray)
+
+def _encode_float(x, ndigits, iterables, iterable_maxsize, content_hash):
+    if math.isinf(x) or math.isnan(x):
         return str(x)
-    elif callable(x) and hasattr(x, "__name__"):
+    elif x == int(x):
+        return str(int(x))
+    else:
+        return str(round(x, ndigits=ndigits)).replace('.', '--')
+
+def _encode_int(x, ndigits, iterables, iterable_maxsize, content_hash):
+    return str(x)
+
+def _encode_object(x, ndigits, iterables, iterable_maxsize, content_hash):
+    if callable(x) and hasattr(x, "__name__"):
         return x.__name__
-    elif isinstance(x, dict):
-        if len(x) >= iterable_maxsize:
-            return "{}-values".format(str(len(x)))
-        else:
-            return dict_to_id(x, ndigits=ndigits, join_char="-", iterable_maxsize=iterable_maxsize)
     elif isinstance(x, iterables):
-        if len(x) >= iterable_maxsize:
-            return "{}-values".format(str(len(x)))
-        else:
-            return '-'.join([encoder(sub_x) for sub_x in x])
+        return _encode_iterable(x, ndigits, iterables, iterable_maxsize, content_hash)
     else:
         return str(x).translate(STR_TRANS_TABLE)
 
+def _encode_dict(x, ndigits, iterables, iterable_maxsize, content_hash):
+    if len(x) >= iterable_maxsize:
+        return f"h{content_digest(x)}" if content_hash else "{}-values".format(str(len(x)))
+    else:
+        return dict_to_id(x, ndigits=ndigits, join_char="-", iterable_maxsize=iterable_maxsize, content_hash=content_hash)
+
+def _encode_iterable(x, ndigits, iterables, iterable_maxsize, content_hash):
+    if not isinstance(x, iterables):
+        return _encode_object(x, ndigits, iterables, iterable_maxsize, content_hash)
+    elif len(x) >= iterable_maxsize:
+        return f"h{content_digest(x)}" if content_hash else "{}-values".format(str(len(x)))
+    else:
+        return '-'.join([encoder(sub_x, content_hash=content_hash) for sub_x in x])
+
+def _encode_array(x, ndigits, iterables, iterable_maxsize, content_hash):
+    if content_hash:
+        return f"h{content_digest(x)}"
+    return _encode_iterable(x, ndigits, iterables, iterable_maxsize, content_hash)
+
+def _encode_pandas(x, ndigits, iterables, iterable_maxsize, content_hash):
+    if content_hash:
+        return f"h{content_digest(x)}"
+    return _encode_object(x, ndigits, iterables, iterable_maxsize, content_hash)
+
+_encoders = {object: _encode_object,
+             float: _encode_float,
+             int: _encode_int,
+             dict: _encode_dict,
+             list: _encode_iterable,
+             tuple: _encode_iterable,
+             np.ndarray: _encode_array,
+             pd.DataFrame: _encode_pandas,
+             pd.Series: _encode_pandas,
+             pd.Index: _encode_pandas,
+            }
+_dispatch_cache = {} # type -> encoder, resolved along the MRO
+_memoized = {int, float, str, bool, type(None)} # hashable scalars whose encodings are memoized
+
+def _dispatch(cls):
+    func = _dispatch_cache.get(cls)
+    if func is None:
+        func = next(_encoders[base] for base in cls.__mro__ if base in _encoders)
+        _dispatch_cache[cls] = func
+    return func
+
+@lru_cache(maxsize=config.ENCODER_MEMO_SIZE, typed=True)
+def _encode_memo(x, ndigits):
+    return _dispatch(type(x))(x, ndigits, _ITERABLES, 3, False)
+
+def register_encoder(cls, func=None, memoize=False):
+    """
+    Registers func as the encoder of the instances of cls (and its subclasses), used by dict_to_id for building filenames.
+
+    Attrs:
+        - cls:       type.
+        - func:      function x -> str. Invalid characters for filenames are replaced (see invalid_str). None => returns a decorator.
+        - memoize:   whether to memoize the encodings. Only for hashable types whose encoding depends on the value alone.
+
+    Example:
+        @register_encoder(Fraction, memoize=True)
+        def encode_fraction(x):
+            return f"{x.numerator}over{x.denominator}"
+    """
+    if func is None:
+        return lambda func: register_encoder(cls, func, memoize=memoize)
+    _encoders[cls] = lambda x, *opts: func(x).translate(STR_TRANS_TABLE)
+    if memoize:
+        _memoized.add(cls)
+    else:
+        _memoized.discard(cls)
+    _dispatch_cache.clear()
+    _encode_memo.cache_clear()
+    return func
+
+def encoder(x, ndigits=2, iterables=_ITERABLES, iterable_maxsize=3, content_hash=False):
+    """
+    x -> string version of x. Dispatched on type(x) (see register_encoder). Encodings of ints, floats, strings, bools and None are memoized.
+    content_hash: encode arrays and pandas objects by their content digest ('h' + content_digest). Same for lists, tuples and dicts with
+                  iterable_maxsize or more elements, instead of their length ('N-values'). Different contents => different encodings.
+    """
+    cls = type(x)
+    if cls in _memoized:
+        try:
+            return _encode_memo(x, ndigits)
+        except TypeError: # unhashable
+            pass
+    return _dispatch(cls)(x, ndigits, iterables, iterable_maxsize, content_hash)
+
+_CONSTANTS = {"none": None, "false": False, "true": True, "inf": math.inf, "-inf": -math.inf, "nan": math.nan}
+_INT = re.compile(r"-?\d+")
+_FLOAT_ENCODED = re.compile(r"-?\d+--\d+")
+_FLOAT = re.compile(r"-?(?:\d+\.\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_TOKEN = re.compile(r"(?P<key>.+?)-(?P<value>-?\d+--\d+|-?[^-]*)") # float values first: '1--5' (1.5), '-1--5' (-1.5)
+
+def _decode_str(x):
+    constant = _CONSTANTS.get(x.lower(), x)
+    if constant is not x:
+        return constant
+    elif _INT.fullmatch(x):
+        return int(x)
+    elif _FLOAT_ENCODED.fullmatch(x):
+        return float(x.replace("--", "."))
+    elif _FLOAT.fullmatch(x):
+        return float(x)
+    else:
+        return x
+
 def decoder(x, iterables=(list, tuple, np.ndarray)):
     """string version of x -> x"""
     if isinstance(x, str):
-        if x.lower() == "none":
-            return None
-        elif x.lower() == "false":
-            return False
-        elif x.lower() == "true":
-            return True
-        elif "--" in x:
-            return float(x.replace("--", "."))
-        elif "." in x:
-            try:
-                return float(x)
-            except:
-                return x
-        else:
-            try:
-                return int(x)
-            except:
-                return x
+        return _decode_str(x)
     elif isinstance(x, iterables):
         return [decoder(sub_x) for sub_x in x]
     else:
         try: # check if x is an integer
             x_int = int(x)
-            if x_int == x:
-                return x_int
-            else:
-                return x
-        except:
+        except (TypeError, ValueError, OverflowError):
             return x
+        return x_int if x_int == x else x
 
 def getopt_printer(opts):
     """Prints getopt input in a readable way."""
     print('\n'.join(f'{opt} => {arg}' for opt, arg in (("Args", "Values"), *opts)))
 
-def dict_to_id(*args, ndigits=2, join_char="_", iterable_maxsize=3, **kwargs):
+def dict_to_id(*args, ndigits=2, join_char="_", iterable_maxsize=3, content_hash=False, **kwargs):
     """Generate ID of the form k1-v1_k2-v2... for k_i, v_i keys and values of the dictionary d or the kwargs."""
-    key_formatter = lambda k: k.replace("_", "-")
     d = args[0] if len(args) > 0 else kwargs
-    return join_char.join([f"{key_formatter(k)}-{encoder(d[k], ndigits=ndigits, iterable_maxsize=iterable_maxsize)}" for k in sorted(d.keys())])
+    return join_char.join([f"{_format_key(k)}-{encoder(d[k], ndigits, _ITERABLES, iterable_maxsize, content_hash)}" for k in sorted(d)])
 
-def id_to_dict(identifier):
-    """Inverse of dict_to_id."""
+@lru_cache(maxsize=1024)
+def _format_key(k):
+    return k.replace("_", "-")
+
+def _parse_token(token):
+    """'k-v' -> (k, decoded v). None if token does not encode an arg."""
+    match = _TOKEN.fullmatch(token)
+    if match is None:
+        return None
+    return match["key"], _decode_str(match["value"])
+
+def _id_tokens(identifier):
+    """Encoded args of a filename or path (hashed filenames are resolved with the reverse index)."""
     s = identifier.split("/")[-1] # retain filename only
-    s = os.path.splitext(s)[0] # remove extension
+    if "/" in identifier:
+        s = original_filename(os.path.dirname(identifier), s)
+    return os.path.splitext(s)[0].split("_") # remove extension
+
+def id_to_dict(identifier):
+    """Inverse of dict_to_id. Hashed filenames are decoded from the reverse index of their directory (see tidypath.hash_index)."""
     d = {}
-    for split in s.split("_"):
-        var_value = split.split("-")
-        if len(var_value) > 1:
-            if "" in var_value: # value is a float
-                var_value_arr = np.array(var_value)
-                idx_dot = np.argwhere(var_value_arr == "")[0, 0]
-                key_idx = 0 if idx_dot == 2 else slice(0, idx_dot-2)
-                d["-".join(var_value[key_idx])] = decoder(f"{var_value_arr[idx_dot-1]}--{var_value_arr[idx_dot+1]}")
-            else:
-                d["-".join(var_value[:-1])] = decoder(var_value[-1])
+    for token in _id_tokens(identifier):
+        parsed = _parse_token(token)
+        if parsed is not None:
+            d[parsed[0]] = parsed[1]
     return d
 
+def _infer_column(values):
+    """Column of decoded values -> array with inferred dtype. Integer columns with missing values => nullable 'Int64'."""
+    if any(v is None for v in values) and all(v is None or (isinstance(v, int) and not isinstance(v, bool)) for v in values):
+        return pd.array(values, dtype="Int64")
+    return pd.Series(values).values
+
+def ids_to_columns(identifiers, infer_dtypes=False):
+    """
+    Batch version of id_to_dict: decodes the args of many filenames (or paths) in one pass.
+    Repeated tokens are parsed once.
+
+    Attrs:
+        - identifiers:    iterable of filenames or paths.
+        - infer_dtypes:   False => {arg: list of values}. Missing args are None.
+                          True  => {arg: array} with the dtype inferred per arg (int, float, bool, object; see _infer_column).
+    Returns: dict.
+    """
+    identifiers = list(identifiers)
+    n = len(identifiers)
+    parsed_tokens = {}
+    columns = {}
+    for i, identifier in enumerate(identifiers):
+        for token in _id_tokens(identifier):
+            parsed = parsed_tokens.get(token, _missing)
+            if parsed is _missing:
+                parsed = parsed_tokens[token] = _parse_token(token)
+            if parsed is not None:
+                column = columns.get(parsed[0])
+                if column is None:
+                    column = columns[parsed[0]] = [None] * n
+                column[i] = parsed[1]
+    if infer_dtypes:
+        columns = {k: _infer_column(v) for k, v in columns.items()}
+    return columns
+
+def ids_to_frame(identifiers, index=None):
+    """
+    DataFrame with the decoded args of many filenames (or paths): one row per identifier, one column per arg (see ids_to_columns).
+    index: DataFrame index. None => range.
+    """
+    identifiers = list(identifiers)
+    return pd.DataFrame(ids_to_columns(identifiers, infer_dtypes=True), index=range(len(identifiers)) if index is None else index)
+
 def id_updater(filename, update_dict, mode="add"):
     """
     Modifies filename by updating the underlying dict.
@@ -148,12 +300,13 @@ def id_renamer(update_dict, parentDir, key=None, mode="add"):
                   - "delete": delete update_dict from the id.
     Returns #modified files.
     NOTE: If update_dict={} => filenames will be rearranged according to other_utils.dict_to_id.
+    NOTE: Only flat directories. For hash-prefix sharded directories use tidypath.add_arg/delete_arg/modify_arg.
     """
     r = 0
     for file in os.listdir(parentDir):
-        if key is None or key in file:
+        if (key is None or key in file) and not file.startswith("."):
             old_filename = os.path.join(parentDir, file)
-            new_filename = id_updater(old_filename, update_dict, mode=mode)
+            new_filename = id_updater(os.path.join(parentDir, original_filename(parentDir, file)), update_dict, mode=mode)
             os.rename(old_filename, new_filename)
             r += 1
     return r
@@ -163,21 +316,128 @@ def id_renamer(update_dict, parentDir, key=None, mode="add"):
 """                                                     II. Other.                                                         """
 ##############################################################################################################################
 
-def hash_file(filename, blocksize=65536):
+def _new_hasher(algorithm):
+    if algorithm.startswith("xxh"):
+        if not _HAVE_XXHASH:
+            raise ImportError(f"algorithm '{algorithm}' requires xxhash. Install it with 'pip install xxhash'.")
+        return getattr(xxhash, algorithm)()
+    else:
+        return hashlib.new(algorithm)
+
+def hash_file(filename, blocksize=2**20, algorithm="sha256", mmap_threshold=2**26):
     """
-    Returns the SHA256 hash of the file.
-    Autogenerated by copilot. Do not trust it.
+    Returns the hex digest of the content of the file.
+
+    Attrs:
+        - blocksize:        size of the reads (bytes). Reads go to a single reused buffer.
+        - algorithm:        hashlib algorithm ('sha256', 'blake2b', 'md5', ...) or xxhash algorithm ('xxh64', 'xxh3_64', 'xxh3_128'; requires xxhash).
+        - mmap_threshold:   files of at least this size (bytes) are mapped in memory and hashed in a single call. None => never.
     """
-    hasher = hashlib.sha256()
+    hasher = _new_hasher(algorithm)
     with open(filename, 'rb') as f:
-        buf = f.read(blocksize)
-        while len(buf) > 0:
-            hasher.update(buf)
-            buf = f.read(blocksize)
+        size = os.fstat(f.fileno()).st_size
+        if mmap_threshold is not None and size > 0 and size >= mmap_threshold:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hasher.update(mm)
+        else:
+            buf = bytearray(blocksize)
+            view = memoryview(buf)
+            n = f.readinto(buf)
+            while n:
+                hasher.update(view[:n])
+                n = f.readinto(buf)
     return hasher.hexdigest()
 
+def hash_files(paths, algorithm="sha256", n_jobs=None, onerror=None, **kwargs):
+    """
+    Digests of many files, computed in parallel threads (hashlib releases the GIL while hashing).
+
+    Attrs:
+        - paths:     iterable of file paths or directory. Directory => all its files, recursively (hidden files excluded).
+        - n_jobs:    number of threads. None => ThreadPoolExecutor default. 1 => sequential.
+        - onerror:   function called with the OSError raised by unreadable files, whose digest is None. None => raise.
+        - kwargs:    passed to hash_file (blocksize, mmap_threshold).
+
+    Returns: {path: hex digest}, in the order of paths. Use it for finding duplicates or comparing against recorded checksums.
+    """
+    if isinstance(paths, (str, os.PathLike)) and os.path.isdir(paths):
+        paths = [record.path for record in scan(paths, recursive=True, include_hidden=False, n_jobs=1 if n_jobs == 1 else 8)]
+    else:
+        paths = list(paths)
+
+    def digest(path):
+        try:
+            return hash_file(path, algorithm=algorithm, **kwargs)
+        except OSError as e:
+            if onerror is None:
+                raise
+            onerror(e)
+            return None
+
+    if n_jobs == 1 or len(paths) < 2:
+        return {path: digest(path) for path in paths}
+    with ThreadPoolExecutor(max_workers=n_jobs, thread_name_prefix="tidypath-hash") as executor:
+        return dict(zip(paths, executor.map(digest, paths)))
+
 def hash_string(s):
     """
     Returns the SHA256 hash of the string.
     """
     return hashlib.sha256(s.encode('utf-8')).hexdigest()
+
+_digest_cache = {} # id(read-only array) -> (weakref, digest)
+
+def _update_digest(hasher, x):
+    """Feeds the content of x to hasher (see content_digest)."""
+    if isinstance(x, np.ndarray):
+        cached = _digest_cache.get(id(x))
+        if cached is not None and cached[0]() is x:
+            hasher.update(cached[1])
+            return
+        array_hasher = hashlib.blake2b(digest_size=16)
+        array_hasher.update(f"ndarray:{x.dtype.str}:{x.shape}".encode())
+        if x.dtype.hasobject:
+            array_hasher.update(pickle.dumps(x.tolist(), protocol=4))
+        else:
+            array_hasher.update(memoryview(np.ascontiguousarray(x)).cast("B")) # no copy if already contiguous
+        digest = array_hasher.digest()
+        if x.base is None and not x.flags.writeable: # owns its memory and read-only => digest valid while the array lives. Views can change through their base
+            try:
+                _digest_cache[id(x)] = (weakref.ref(x, lambda _, key=id(x): _digest_cache.pop(key, None)), digest)
+            except TypeError: # not weak-referenceable
+                pass
+        hasher.update(digest)
+    elif isinstance(x, (pd.DataFrame, pd.Series, pd.Index)):
+        hasher.update(f"{type(x).__name__}:{x.shape}".encode())
+        if isinstance(x, pd.DataFrame):
+            hasher.update(pickle.dumps((list(x.columns), [str(dtype) for dtype in x.dtypes]), protocol=4))
+        else:
+            hasher.update(pickle.dumps((x.name, str(x.dtype)), protocol=4))
+        _update_digest(hasher, pd.util.hash_pandas_object(x, index=not isinstance(x, pd.Index)).values)
+    elif isinstance(x, dict):
+        hasher.update(f"dict:{len(x)}".encode())
+        for k in sorted(x, key=repr):
+            _update_digest(hasher, k)
+            _update_digest(hasher, x[k])
+    elif isinstance(x, (list, tuple)):
+        hasher.update(f"{type(x).__name__}:{len(x)}".encode())
+        if all(isinstance(sub_x, _SCALARS) for sub_x in x):
+            hasher.update(pickle.dumps(x, protocol=4))
+        else:
+            for sub_x in x:
+                _update_digest(hasher, sub_x)
+    else:
+        hasher.update(pickle.dumps(x, protocol=4))
+    return
+
+def content_digest(x):
+    """
+    Digest (blake2b, 128 bits, hex) of the content of x. Used for encoding large arguments (see encoder).
+        - arrays:           dtype, shape and raw buffer (hashed in place if contiguous). Digests of read-only arrays owning their memory are cached per object.
+        - pandas objects:   columns, dtypes and pandas.util.hash_pandas_object (vectorized, includes the index).
+        - dicts, lists, tuples: recursive. Containers of scalars are hashed in a single pass.
+        - other objects:    their pickle.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    _update_digest(hasher, x)
+    return hasher.hexdigest()
@@ -0,0 +1,57 @@
+"""
+Reverse index of hashed filenames.
+
+Filenames longer than 'max_str_length' are replaced by their hash (see paths.hash_path). The index ('.tidypath_hash_index' in each directory)
+maps every hashed filename to the original one, so hashed entries can be decoded (fmt.id_to_dict) and renamed (add_arg, delete_arg, modify_arg)
+without recomputing hashes.
+The index is an append-only journal of JSON lines (see tidypath.journal), updated on every hashed save. Records appended by other processes
+are read incrementally. Corrupted lines (interleaved appends on NFS) are skipped and the index is compacted.
+"""
+import os
+import re
+import threading
+from .journal import Journal
+
+hash_index_name = ".tidypath_hash_index"
+
+_HASHED = re.compile(r"[0-9a-f]{64}")
+
+_indices = {}   # directory -> (Journal, {hashed filename: original filename})
+_lock = threading.RLock()
+
+def is_hashed(filename):
+    """Whether filename (without extension) is a SHA256 hash."""
+    return _HASHED.fullmatch(os.path.splitext(filename)[0]) is not None
+
+def load_hash_index(directory):
+    """{hashed filename: original filename} of directory."""
+    key = os.path.abspath(directory)
+    with _lock:
+        state = _indices.get(key)
+        if state is None:
+            state = _indices[key] = (Journal(os.path.join(key, hash_index_name)), {})
+        journal, index = state
+        records, reset, n_bad = journal.read()
+        if reset:
+            index.clear()
+        for record in records:
+            if "h" in record and "k" in record:
+                index[record["h"]] = record["k"]
+        if n_bad:
+            journal.rewrite([dict(h=h, k=k) for h, k in index.items()])
+            return load_hash_index(directory)
+        return index
+
+def record_hash(directory, hashed, original):
+    """Adds hashed filename -> original filename to the index of directory (if not recorded yet)."""
+    if load_hash_index(directory).get(hashed) != original:
+        with _lock:
+            _indices[os.path.abspath(directory)][0].append([dict(h=hashed, k=original)])
+    return
+
+def original_filename(directory, filename):
+    """Original filename of a hashed filename. Not hashed or not in the index => filename."""
+    if is_hashed(filename):
+        return load_hash_index(directory).get(filename, filename)
+    else:
+        return filename
@@ -3,15 +3,45 @@ Analyze variables passed to functions, parent class, merge wrapper and wrapped s
 """
 import inspect
 import functools
+from collections import namedtuple
 
-def classify_call_attrs(func, args, kwargs, add_pos_only_to_all=False):
+CallPlan = namedtuple("CallPlan", ["num_static", "static_names", "args_default", "kwargs_defaults", "pos_only_name"])
+
+def compile_call_plan(func):
+    """
+    Precomputes the parts of classify_call_attrs that only depend on func: parameter kinds, defaults and *args name.
+    Compute it once per function (at decoration time) and pass it to classify_call_attrs.
+    """
+    code = func.__code__
+    if code.co_kwonlyargcount > 0: # func has keyword-only args: f(*args, k1=v1, ..., kn=vn)
+        kwonly_defaults = func.__kwdefaults__ or {}
+    else:
+        kwonly_defaults = {}
+
+    defaults = () if func.__defaults__ is None else func.__defaults__  # f(k1=v1,...)
+    num_static = code.co_argcount - len(defaults)                       # f(k1,k2)
+    args_default = code.co_varnames[num_static:code.co_argcount]
+    kwargs_defaults = {**dict(zip(args_default, defaults)), **kwonly_defaults}
+
+    pos_only_name = [p.name for p in inspect.signature(func).parameters.values() if p.kind.name == "VAR_POSITIONAL"]
+    if pos_only_name:
+        pos_only_name = f"*{pos_only_name[0]}"
+    else:
+        pos_only_name = "*pos_only"
+    return CallPlan(num_static=num_static,
+                    static_names=code.co_varnames[:num_static],
+                    args_default=args_default,
+                    kwargs_defaults=kwargs_defaults,
+                    pos_only_name=pos_only_name)
+
+def classify_call_attrs(func, args, kwargs, add_pos_only_to_all=False, plan=None):
     """
     Classify function args and kwargs passed during function call
     
-    NOTE:  Probably could be done more efficiently relying more on inspect.getargspec(func) or inspect.signature(func), but realized later.
-    NOTE2: For position-only arguments f(*args), 
+    NOTE:  For position-only arguments f(*args), 
            usually referred in the docs as f(pos1, pos2, /, pos_or_kwd,...)  ('/' indicates end of position-only-args),
            only provides the number of *args.
+    NOTE2: plan (see compile_call_plan) avoids inspecting func on every call. If None, it is computed.
     
     Example: dict()
     
@@ -24,40 +54,24 @@ def classify_call_attrs(func, args, kwargs, add_pos_only_to_all=False):
         "all"              =>  add_pos_only_to_all == False => all attrs except pos_only: kwargs_full + args
                                else                         => all attrs: kwargs_full + args + pos_only
     """
-    code = func.__code__
-    num_kwonly = code.co_kwonlyargcount
-    if num_kwonly > 0: # func has keyword-only args: f(*args, k1=v1, ..., kn=vn)
-        kwonly_defaults = func.__kwdefaults__
-    else:
-        kwonly_defaults = {}
-
-    num_defaults = 0 if func.__defaults__ is None else len(func.__defaults__) # f(k1=v1,...)
-    num_static = code.co_argcount - num_defaults                              # f(k1,k2)
-    if num_defaults > 0:
-        args_default = code.co_varnames[:code.co_argcount][-num_defaults:]
-        kwargs_defaults = dict(zip(args_default, func.__defaults__))
-                                      
-        kwargs_positional_keys = [k for k in args_default if k not in kwargs]         # f(k1, k2=v2, ...) called as f(v1, v2, ...) 
+    if plan is None:
+        plan = compile_call_plan(func)
+    num_static = plan.num_static
+    if plan.args_default:
+        kwargs_positional_keys = [k for k in plan.args_default if k not in kwargs]    # f(k1, k2=v2, ...) called as f(v1, v2, ...) 
         kwargs_positional = dict(zip(kwargs_positional_keys, args[num_static:]))
         num_kwargs_positional = len(kwargs_positional)
         
         kwargs = {**kwargs_positional, **kwargs}        
     else:
         num_kwargs_positional = 0
-        kwargs_defaults = {}
         
-    kwargs_defaults.update(kwonly_defaults)
-                    
+    kwargs_defaults = dict(plan.kwargs_defaults)
     full_kwargs = {**kwargs_defaults, **kwargs}
-    static_attrs = {k: v for k, v in zip(code.co_varnames[:num_static], args)}    
+    static_attrs = dict(zip(plan.static_names, args))
     attrs = {**static_attrs, **full_kwargs} 
     
-    pos_only_name = [p.name for p in inspect.signature(func).parameters.values() if p.kind.name == "VAR_POSITIONAL"]
-    if pos_only_name:
-        pos_only_name = f"*{pos_only_name[0]}"
-    else:
-        pos_only_name = "*pos_only"
-    pos_only = {pos_only_name: len(args) - num_static - num_kwargs_positional}
+    pos_only = {plan.pos_only_name: len(args) - num_static - num_kwargs_positional}
     if add_pos_only_to_all:
         attrs.update(pos_only)
     
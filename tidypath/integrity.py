@@ -0,0 +1,103 @@
+"""
+Corruption checks of stored results against the size and checksum recorded in the manifest at saving time (tidypath.manifest).
+
+    - check_file:   used by 'savedata' on hits (verify="size" or "checksum"), before loading the stored file.
+    - verify:       checks every recorded file of a directory in parallel threads. Bad entries can be quarantined.
+                    Nothing is loaded or recomputed: quarantined entries are recomputed by the next call that needs them.
+"""
+import os
+import stat
+import shutil
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from .fmt import hash_file
+from .manifest import get_manifest, manifest_name
+from .paths import func_directory
+from .scan import scan
+
+quarantine_name = ".tidypath_quarantine"
+
+class CorruptedFileError(Exception):
+    pass
+
+def _check(path, record, checksum):
+    """(status, detail) of the file at path. status: 'ok', 'missing', 'size' (size mismatch), 'checksum' (checksum mismatch)."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return "missing", None
+    if not stat.S_ISREG(st.st_mode): # directories with an extension ('npydir')
+        return "ok", None
+    if st.st_size != record["s"]:
+        return "size", f"size {st.st_size} != recorded {record['s']}"
+    if checksum and record.get("c"):
+        algorithm, digest = record["c"].split(":", 1)
+        if hash_file(path, algorithm=algorithm) != digest:
+            return "checksum", f"{algorithm} checksum != recorded"
+    return "ok", None
+
+def check_file(path, checksum=False):
+    """
+    Raises CorruptedFileError if the file at path does not match its manifest record. Files without a record are not checked.
+    checksum: whether to compare the checksum too (reads the whole file). Otherwise only the size is compared.
+    """
+    directory, filename = os.path.split(path)
+    manifest = get_manifest(directory)
+    if manifest.contains(filename):
+        status, detail = _check(path, manifest.get(filename), checksum)
+        if status == "size" or status == "checksum": # the record may be stale: file overwritten by another process
+            manifest.refresh(force=True)
+            record = manifest.get(filename)
+            if record is None: # removed in the meantime
+                return
+            status, detail = _check(path, record, checksum)
+            if status == "size" or status == "checksum":
+                raise CorruptedFileError(f"'{path}': {detail}.")
+    return
+
+def quarantine(path, directory):
+    """Moves path (inside directory) to the quarantine of directory, keeping its relative path. Returns the new path."""
+    new_path = os.path.join(directory, quarantine_name, os.path.relpath(path, directory))
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    shutil.move(path, new_path)
+    return new_path
+
+def verify(func_or_directory, checksum=True, n_jobs=None, quarantine_bad=False):
+    """
+    Checks the files recorded in the manifests of a directory (and its hash-prefix shards) against their recorded size and checksum.
+
+    Attrs:
+        - func_or_directory:   function (wrapped by savedata) or directory.
+        - checksum:            whether to compare checksums (reads every file). False => sizes only. Records without checksum are checked by size.
+        - n_jobs:              number of threads. None => ThreadPoolExecutor default. 1 => sequential.
+        - quarantine_bad:      whether to move bad files to the quarantine ('.tidypath_quarantine' in the directory) and drop their records.
+                               Missing files are dropped from the manifest.
+
+    Returns: DataFrame with columns path, status ('ok', 'missing', 'size', 'checksum'), detail, quarantined (new path or None).
+    """
+    directory = func_directory(func_or_directory)
+    quarantine_dir = os.path.join(directory, quarantine_name)
+    manifest_dirs = [os.path.dirname(record.path) for record in scan(directory, recursive=True, ext=manifest_name)
+                     if not record.path.startswith(quarantine_dir + os.sep)]
+    manifests = [get_manifest(manifest_dir) for manifest_dir in manifest_dirs]
+    for manifest in manifests: # records appended by other processes
+        manifest.refresh(force=True)
+    entries = [(manifest.directory, filename, record) for manifest in manifests for filename, record in list(manifest.entries.items())]
+
+    def check(entry):
+        manifest_dir, filename, record = entry
+        path = os.path.join(manifest_dir, filename)
+        status, detail = _check(path, record, checksum)
+        quarantined = None
+        if quarantine_bad and status != "ok":
+            if status != "missing":
+                quarantined = quarantine(path, directory)
+            get_manifest(manifest_dir).remove(filename)
+        return dict(path=path, status=status, detail=detail, quarantined=quarantined)
+
+    if n_jobs == 1 or len(entries) < 2:
+        rows = [check(entry) for entry in entries]
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs, thread_name_prefix="tidypath-verify") as executor:
+            rows = list(executor.map(check, entries))
+    return pd.DataFrame(rows, columns=["path", "status", "detail", "quarantined"])
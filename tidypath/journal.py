@@ -0,0 +1,96 @@
+"""
+Append-only journals of JSON lines, shared by the manifest (tidypath.manifest), the hash index (tidypath.hash_index) and the
+access journal (tidypath.eviction).
+
+Records are appended in a single write per batch and read incrementally (by inode and offset), so several processes can update a journal.
+Appends are not atomic everywhere (NFS clients can interleave them): lines that cannot be decoded are skipped with a warning and reported,
+so the owner can rebuild or compact the journal.
+"""
+import os
+import json
+import threading
+import warnings
+from .storage import atomic_path
+
+def parse_lines(data):
+    """
+    Records of the complete lines of data (bytes). The last line is skipped if it is incomplete (being written).
+    Returns: (records, end offset of the parsed data, number of undecodable lines).
+    """
+    end = data.rfind(b"\n") + 1
+    records = []
+    n_bad = 0
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError: # truncated or interleaved line
+            n_bad += 1
+            continue
+        if isinstance(record, dict):
+            records.append(record)
+        else:
+            n_bad += 1
+    return records, end, n_bad
+
+def encode(records):
+    return "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records).encode()
+
+class Journal():
+    """
+    Incremental reader and writer of a JSON lines file.
+
+    Attrs:
+        - path:   path of the journal.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._inode = None
+        self._offset = 0
+        self._lock = threading.RLock()
+
+    def read(self):
+        """
+        Records appended since the last read.
+        Returns: (records, reset, n_bad). reset => the journal was rewritten or removed and records start from the beginning: discard previous records.
+                 n_bad: number of lines skipped because they could not be decoded.
+        """
+        with self._lock:
+            try:
+                with open(self.path, 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    reset = st.st_ino != self._inode or st.st_size < self._offset
+                    if reset:
+                        self._inode = st.st_ino
+                        self._offset = 0
+                    elif st.st_size == self._offset:
+                        return [], False, 0
+                    f.seek(self._offset)
+                    data = f.read()
+            except FileNotFoundError:
+                self._inode = None
+                self._offset = 0
+                return [], True, 0
+            records, end, n_bad = parse_lines(data)
+            self._offset += end
+            if n_bad:
+                warnings.warn(f"Skipped {n_bad} corrupted line(s) of '{self.path}'.", RuntimeWarning)
+            return records, reset, n_bad
+
+    def append(self, records):
+        """Appends records in a single write."""
+        if not records:
+            return
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(encode(records))
+
+    def rewrite(self, records):
+        """Atomically replaces the journal with records. The next read starts from the beginning (reset)."""
+        with self._lock:
+            with atomic_path(self.path) as tmp_path:
+                with open(tmp_path, 'wb') as f:
+                    f.write(encode(records))
+
+def read_journal(path):
+    """All the records of the journal at path. Missing => []."""
+    return Journal(path).read()[0]
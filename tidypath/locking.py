@@ -0,0 +1,145 @@
+"""
+Inter-process file locks. Used by 'savedata' so that only one process computes a given key while the rest wait and load it.
+
+Locks rely on fcntl.flock where available: released by the OS if the holder dies, so they are never broken.
+Elsewhere they fall back to exclusive lock-file creation. The lock file records the holder (host and PID). It is broken if the holder
+is a dead process of the same host or, for holders on other hosts, if it is older than 'stale_timeout' seconds.
+"""
+import os
+import time
+import socket
+from .fmt import hash_string
+
+try:
+    import fcntl
+    _HAVE_FCNTL = True
+except ImportError:
+    _HAVE_FCNTL = False
+
+def lock_path(path):
+    """Hidden lock file next to path: dir/.filename.lock"""
+    parent_dir, filename = os.path.split(path)
+    if len(filename) > 240:
+        filename = hash_string(filename)
+    return os.path.join(parent_dir, f".{filename}.lock")
+
+class FileLock():
+    """
+    Exclusive lock on a file path. Usable as a context manager.
+
+    Attrs:
+        - path:            path of the lock file.
+        - timeout:         max waiting time (seconds). None => wait indefinitely. If exceeded, 'acquire' raises TimeoutError.
+        - stale_timeout:   fallback locks (no fcntl) of other hosts held for longer than this (seconds) are considered stale and broken.
+                           None => only break locks of dead processes of this host.
+        - poll_interval:   time between acquisition attempts (seconds).
+    """
+    def __init__(self, path, timeout=None, stale_timeout=3600, poll_interval=0.05):
+        self.path = path
+        self.timeout = timeout
+        self.stale_timeout = stale_timeout
+        self.poll_interval = poll_interval
+        self._fd = None
+
+    @property
+    def locked(self):
+        return self._fd is not None
+
+    def acquire(self):
+        start = time.monotonic()
+        while not self._try_acquire():
+            inode, stale = self._is_stale()
+            if stale:
+                self._break(inode)
+            elif self.timeout is not None and time.monotonic() - start > self.timeout:
+                raise TimeoutError(f"Could not acquire lock '{self.path}' in {self.timeout} seconds.")
+            else:
+                time.sleep(self.poll_interval)
+        return self
+
+    def release(self):
+        if self._fd is None:
+            return
+        # unlink before unlocking: waiters holding the old inode notice the mismatch and retry.
+        # Only our own file: if the lock was broken, the file may belong to the new holder.
+        try:
+            if os.stat(self.path).st_ino == os.fstat(self._fd).st_ino:
+                os.unlink(self.path)
+        except FileNotFoundError: # lock was broken by another process
+            pass
+        if _HAVE_FCNTL:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def _try_acquire(self):
+        if _HAVE_FCNTL:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            try:
+                same_file = os.stat(self.path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                same_file = False
+            if not same_file: # previous holder unlinked the file after we opened it
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+                return False
+        else:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                return False
+        # record the holder. Also refreshes the mtime used for stale detection.
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{socket.gethostname()}:{os.getpid()}".encode())
+        self._fd = fd
+        return True
+
+    def _is_stale(self):
+        """Stale fallback lock: (inode of the lock file, True) or (None, False). flock locks are never stale."""
+        if _HAVE_FCNTL:
+            return None, False
+        try:
+            with open(self.path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                holder = f.read(1024).decode(errors="replace")
+        except FileNotFoundError:
+            return None, False
+        host, _, pid = holder.rpartition(":")
+        if host == socket.gethostname() and pid.isdigit():
+            alive = _pid_alive(int(pid))
+            if alive is not None:
+                return st.st_ino, not alive
+        if not holder and time.time() - st.st_mtime < 1: # being created: holder not written yet
+            return None, False
+        stale = self.stale_timeout is not None and time.time() - st.st_mtime > self.stale_timeout
+        return st.st_ino, stale
+
+    def _break(self, inode):
+        try:
+            if os.stat(self.path).st_ino == inode: # not replaced by a new holder in the meantime
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+def _pid_alive(pid):
+    """Whether a process of this host is running. None => unknown."""
+    if os.name != "posix":
+        return None # os.kill terminates the process on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # exists, owned by another user
+        return True
+    return True
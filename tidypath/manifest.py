@@ -0,0 +1,224 @@
+"""
+Per-directory manifest of stored files: filename -> (size, mtime, checksum).
+
+Lets 'savedata' decide hits and misses from memory instead of probing the filesystem on every call.
+The manifest is an append-only journal of JSON lines ('.tidypath_manifest' in the function directory, see tidypath.journal), so several
+processes can update it concurrently. Records appended by other processes are read incrementally. If some line is corrupted
+(interleaved appends on NFS), the manifest is rebuilt from the directory.
+"""
+import os
+import stat
+import time
+import threading
+import warnings
+from collections import defaultdict
+from . import config
+from .fmt import hash_file
+from .paths import func_directory, layout_entries
+from .journal import Journal, encode, read_journal
+from .storage import atomic_path
+
+manifest_name = ".tidypath_manifest"
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+def is_hidden(filename):
+    """Hidden files (manifest, locks, temporary files) are not part of the cache."""
+    return filename.startswith(".")
+
+def file_record(path, checksum=True):
+    """Manifest record of the file at path."""
+    st = os.stat(path)
+    return dict(f=os.path.basename(path),
+                s=st.st_size,
+                m=st.st_mtime,
+                c=f"sha256:{hash_file(path)}" if checksum and stat.S_ISREG(st.st_mode) else None)
+
+class Manifest():
+    """
+    In-memory view of the manifest of a directory.
+
+    Attrs:
+        - directory:          directory containing the stored files.
+        - refresh_interval:   min time (seconds) between reads of records appended by other processes, triggered by misses.
+    """
+    def __init__(self, directory, refresh_interval=1.0):
+        self.directory = directory
+        self.path = os.path.join(directory, manifest_name)
+        self.refresh_interval = refresh_interval
+        self.entries = {}
+        self._journal = Journal(self.path)
+        self._last_refresh = -float("inf")
+        self._lock = threading.RLock()
+        if not os.path.exists(self.path) and os.path.isdir(directory) and any(not is_hidden(f) for f in os.listdir(directory)):
+            rebuild_manifest(directory, checksum=False, _manifest=self)
+        else:
+            self.refresh(force=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, filename):
+        return self.contains(filename)
+
+    def contains(self, filename, refresh=True):
+        """Whether filename is stored. If not found, records appended by other processes are read first (at most every refresh_interval seconds)."""
+        if filename in self.entries:
+            return True
+        elif refresh and self.refresh():
+            return filename in self.entries
+        else:
+            return False
+
+    def get(self, filename, default=None):
+        return self.entries.get(filename, default)
+
+    def refresh(self, force=False):
+        """Reads the records appended since the last refresh. Returns whether the manifest was read."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_refresh < self.refresh_interval:
+                return False
+            self._last_refresh = now
+            records, reset, n_bad = self._journal.read()
+            if reset:
+                self.entries = {}
+            for record in records:
+                self._apply(record)
+            if n_bad:
+                warnings.warn(f"Rebuilding the manifest of '{self.directory}' ...", RuntimeWarning)
+                rebuild_manifest(self.directory, checksum=False, keep=self.entries, _manifest=self)
+            return True
+
+    def record(self, filename, checksum=config.MANIFEST_CHECKSUM):
+        """Adds (or updates) the record of a stored file."""
+        record = file_record(os.path.join(self.directory, filename), checksum=checksum)
+        self._append([record])
+        return record
+
+    def remove(self, filename):
+        if filename in self.entries:
+            self._append([dict(f=filename, d=1)])
+
+    def rename(self, mapping):
+        """Updates records after renaming files. mapping: {old_filename: new_filename}."""
+        renamed = {new: self.entries[old] for old, new in mapping.items() if old in self.entries} # before applying: chains, swaps
+        records = [dict(f=old, d=1) for old in mapping if old in self.entries and old not in renamed]
+        records += [{**record, "f": new} for new, record in renamed.items()]
+        self._append(records)
+
+    def _apply(self, record):
+        if record.get("d"):
+            self.entries.pop(record["f"], None)
+        else:
+            self.entries[record["f"]] = record
+
+    def _append(self, records):
+        if not records:
+            return
+        with self._lock:
+            self._journal.append(records)
+            for r in records:
+                self._apply(r)
+
+def get_manifest(directory):
+    """Manifest of directory, shared within the process."""
+    key = os.path.abspath(directory)
+    manifest = _manifests.get(key)
+    if manifest is None:
+        with _manifests_lock:
+            manifest = _manifests.get(key)
+            if manifest is None:
+                manifest = Manifest(directory, refresh_interval=config.MANIFEST_REFRESH_INTERVAL)
+                _manifests[key] = manifest
+    return manifest
+
+def _recorded_entries(path):
+    """{filename: record} of the manifest at path, read without caching it. Missing => {}."""
+    entries = {}
+    for record in read_journal(path):
+        if record.get("d"):
+            entries.pop(record.get("f"), None)
+        elif "f" in record:
+            entries[record["f"]] = record
+    return entries
+
+def rebuild_manifest(func_or_directory, checksum=True, keep=None, _manifest=None):
+    """
+    Rebuilds the manifest of a directory from the files it contains. Use it for directories populated before the manifest existed,
+    or after modifying files without tidypath.
+    Hash-prefix layouts (see paths.get_layout): every shard directory gets its own manifest.
+
+    Attrs:
+        - func_or_directory:   function (wrapped by savedata) or directory.
+        - checksum:            whether to compute the checksum of every file. Slow for large directories.
+        - keep:                {filename: record} of the files of the directory. Checksums of records whose size and mtime still match are kept
+                               instead of being recomputed or lost. None => records of the current manifests.
+
+    Returns: Manifest of the directory.
+    """
+    directory = func_directory(func_or_directory)
+    records = defaultdict(list) # subdirectory -> records
+    records[""] = []
+    keeps = {} if keep is None else {"": keep}
+    for rel_path in layout_entries(directory):
+        subdir, filename = os.path.split(rel_path)
+        path = os.path.join(directory, rel_path)
+        is_file = os.path.isfile(path)
+        if not (is_file or "." in filename): # directories with an extension: outputs of 'save_npydir'
+            continue
+        if subdir not in keeps:
+            keeps[subdir] = _recorded_entries(os.path.join(directory, subdir, manifest_name))
+        st = os.stat(path)
+        kept = keeps[subdir].get(filename)
+        if kept is not None and kept.get("c") and kept.get("s") == st.st_size and kept.get("m") == st.st_mtime:
+            c = kept["c"]
+        else:
+            c = f"sha256:{hash_file(path)}" if checksum and is_file else None
+        records[subdir].append(dict(f=filename, s=st.st_size, m=st.st_mtime, c=c))
+    for subdir, subdir_records in records.items():
+        with atomic_path(os.path.join(directory, subdir, manifest_name)) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(encode(subdir_records))
+    if _manifest is None:
+        manifest = get_manifest(directory)
+    else:
+        manifest = _manifest
+    manifest.refresh(force=True)
+    for subdir in records:
+        key = os.path.abspath(os.path.join(directory, subdir))
+        if subdir and key in _manifests: # loaded shard manifests
+            _manifests[key].refresh(force=True)
+    return manifest
+
+def update_manifest_renames(directory, mapping):
+    """
+    Applies file renames {old_filename: new_filename} to the manifests of directory, if it has them.
+    Filenames can be relative paths (hash-prefix shards): each subdirectory has its own manifest.
+    """
+    renames = defaultdict(dict)
+    moves = []
+    for old, new in mapping.items():
+        old_dir, old_filename = os.path.split(old)
+        new_dir, new_filename = os.path.split(new)
+        if old_dir == new_dir:
+            renames[old_dir][old_filename] = new_filename
+        else:
+            moves.append((old_dir, old_filename, new_dir, new_filename))
+    for subdir, subdir_renames in renames.items():
+        if os.path.exists(os.path.join(directory, subdir, manifest_name)):
+            get_manifest(os.path.join(directory, subdir)).rename(subdir_renames)
+    for old_dir, old_filename, new_dir, new_filename in moves:
+        record = None
+        if os.path.exists(os.path.join(directory, old_dir, manifest_name)):
+            old_manifest = get_manifest(os.path.join(directory, old_dir))
+            record = old_manifest.get(old_filename)
+            old_manifest.remove(old_filename)
+        if os.path.exists(os.path.join(directory, new_dir, manifest_name)):
+            new_manifest = get_manifest(os.path.join(directory, new_dir))
+            if record is None:
+                new_manifest.record(new_filename, checksum=False)
+            else:
+                new_manifest._append([{**record, "f": new_filename}])
+    return
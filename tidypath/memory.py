@@ -0,0 +1,130 @@
+"""
+In-process memory tier for 'savedata'.
+Keeps recently loaded/computed results in an LRU dict keyed by saving path, so repeated cache hits skip decompression and unpickling.
+"""
+import os
+import sys
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from . import config
+
+
+def getsize(obj, _seen=None):
+    """
+    Approximate memory footprint (in bytes) of obj.
+    Arrays and pandas objects report their buffer size. Containers are traversed recursively.
+    Memory-mapped arrays only count their header, since their data lives in the page cache.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, np.memmap):
+        return sys.getsizeof(obj)
+    elif isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            return obj.nbytes + sum(getsize(x, _seen) for x in obj.flat)
+        else:
+            return obj.nbytes
+    elif isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        size = obj.memory_usage(deep=True)
+        return int(size.sum()) if isinstance(size, pd.Series) else int(size)
+    elif isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(getsize(k, _seen) + getsize(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(getsize(x, _seen) for x in obj)
+    else:
+        return sys.getsizeof(obj)
+
+def file_signature(path):
+    """(mtime_ns, size) of path, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+class MemoryCache():
+    """
+    LRU cache of results keyed by saving path.
+
+    Each entry stores the file signature (mtime, size) at the moment it was cached.
+    An entry is dropped when the file on disk changes, when it is invalidated explicitly, or when the limits are exceeded.
+
+    NOTE: Cached objects are shared between callers. Modifying a returned result in place modifies the cached copy.
+
+    Attrs:
+        - max_entries:    maximum number of cached results. None => unbounded.
+        - max_bytes:      maximum total size (see 'getsize'). None => unbounded. Results larger than max_bytes are not cached.
+    """
+    def __init__(self, max_entries=128, max_bytes=2**30):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def get(self, path, default=None):
+        """Returns the cached result for path if the file on disk did not change since it was cached."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return default
+            signature, result, _ = entry
+            if signature != file_signature(path):
+                self._pop(path)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return result
+
+    def put(self, path, result, signature=None):
+        """Caches result for path. signature defaults to the current file signature; if the file does not exist, nothing is cached."""
+        if signature is None:
+            signature = file_signature(path)
+            if signature is None:
+                return
+        size = getsize(result)
+        if self.max_bytes is not None and size > self.max_bytes:
+            self.invalidate(path)
+            return
+        with self._lock:
+            self._pop(path)
+            self._entries[path] = (signature, result, size)
+            self.nbytes += size
+            self._evict()
+
+    def invalidate(self, path):
+        with self._lock:
+            self._pop(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _pop(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+
+    def _evict(self):
+        while self._entries and ((self.max_entries is not None and len(self._entries) > self.max_entries)
+                                 or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+
+memory_cache = MemoryCache(max_entries=config.MEMORY_CACHE_MAX_ENTRIES, max_bytes=config.MEMORY_CACHE_MAX_BYTES)
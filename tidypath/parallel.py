@@ -0,0 +1,99 @@
+"""
+Parallel execution of 'savedata'-wrapped functions over parameter grids.
+Cached keys are loaded in the calling process. Missing keys are computed (and stored) by a pool of workers.
+"""
+import os
+import sys
+import itertools
+from pathlib import Path
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+def param_grid(grid):
+    """
+    Expands a parameter grid into a list of kwargs.
+
+    Attrs:
+        - grid:   · dict:      {arg: values}. Returns the cartesian product of the values. Non-list values are kept fixed.
+                               Example: {'x': [1, 2], 'z': 3} -> [{'x': 1, 'z': 3}, {'x': 2, 'z': 3}]
+                  · iterable:  kwargs for each call. Example: [{'x': 1}, {'x': 2, 'z': 5}]
+    """
+    if isinstance(grid, Mapping):
+        names = list(grid)
+        values = [v if isinstance(v, (list, tuple, range)) else [v] for v in grid.values()]
+        return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+    else:
+        return [dict(kwargs) for kwargs in grid]
+
+def _call(func, kwargs, call_opts):
+    return func(**kwargs, **call_opts)
+
+def is_cached(func, kwargs, **call_opts):
+    """Whether the outputs of func(**kwargs) are stored for all extensions."""
+    if call_opts.get("overwrite", False):
+        return False
+    is_stored = getattr(func, "_is_stored", None) # backend-aware (sqlite keys, manifest)
+    if is_stored is None:
+        is_stored = lambda path: Path(path).exists()
+    return all(is_stored(path) for path in func(**kwargs, **call_opts, return_path=True))
+
+def map_grid(func, grid, n_jobs=None, backend="process", ordered=True, **call_opts):
+    """
+    Evaluates a function decorated with 'savedata' over a parameter grid. Available as func.map(grid, ...).
+
+    Saving paths are resolved first. Stored keys are loaded in the calling process, the rest are distributed over the workers.
+    Results are stored exactly as in sequential calls.
+
+    Attrs:
+        - func:        function decorated with 'savedata'.
+        - grid:        parameter grid (see 'param_grid').
+        - n_jobs:      number of workers. None or -1 => os.cpu_count(). 1 => sequential, in the calling process.
+        - backend:     'process' or 'thread'. For 'process', func and its arguments must be picklable (func defined at module level).
+        - ordered:     True  => yields results in grid order.
+                       False => yields (index, result) pairs as they are available. index is the position in the grid.
+        - call_opts:   extra arguments of the decorated function passed to every call. Example: ext, overwrite, keys.
+
+    Returns: generator.
+    """
+    calls = param_grid(grid)
+    if n_jobs is None or n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if backend == "process":
+        Executor = ProcessPoolExecutor
+    elif backend == "thread":
+        Executor = ThreadPoolExecutor
+    else:
+        raise ValueError(f"backend '{backend}' not valid. Available: 'process', 'thread'.")
+
+    cached = [is_cached(func, kwargs, **call_opts) for kwargs in calls]
+    missing = [i for i, c in enumerate(cached) if not c]
+    if n_jobs == 1 or len(missing) < 2:
+        for i, kwargs in enumerate(calls):
+            result = _call(func, kwargs, call_opts)
+            yield result if ordered else (i, result)
+        return
+
+    executor = Executor(max_workers=min(n_jobs, len(missing)))
+    futures = {}
+    try:
+        futures = {i: executor.submit(_call, func, calls[i], call_opts) for i in missing}
+        if ordered:
+            for i, kwargs in enumerate(calls):
+                if cached[i]:
+                    yield _call(func, kwargs, call_opts)
+                else:
+                    yield futures.pop(i).result()
+        else:
+            for i, kwargs in enumerate(calls):
+                if cached[i]:
+                    yield i, _call(func, kwargs, call_opts)
+            index = {future: i for i, future in futures.items()}
+            for future in as_completed(index):
+                yield index[future], future.result()
+    finally:
+        if sys.version_info >= (3, 9):
+            executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            for future in futures.values():
+                future.cancel()
+            executor.shutdown(wait=True)
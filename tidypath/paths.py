@@ -10,41 +10,58 @@ Two schemes:
 """
 import os
 import sys
+import re
 import inspect
 import warnings
-import numpy as np
 import pandas as pd
-import datetime
-from copy import deepcopy
+import time
+import json
+import uuid
+import shutil
+from bisect import bisect_left
+from functools import lru_cache
 from collections.abc import Iterable
 from pathlib import Path
 from .fmt import dict_to_id, encoder, hash_string
 from .inspection import get_class_that_defined_method
+from .database import find_database
+from .scan import scan_frame
+from .storage import atomic_path
+from .hash_index import record_hash, original_filename
 
 dataDir = "data"
 figDir = "figs"
+rename_journal_name = ".tidypath_rename_journal"
+layout_name = ".tidypath_layout"
 
-def time_since_last_update(parent_dir, ext='lzma'):
+_created_dirs = set()
+_layouts = {}
+_SHARD = re.compile(r"[0-9a-f]{2}")
+
+def time_since_last_update(parent_dir, ext='lzma', recursive=False, n_jobs=1):
     """
     Returns a pandas Series with the time since last update of each file in parent_dir.
+
+    Attrs:
+        - ext:         only files (or directories, e.g. 'npydir') ending with ext. None => all.
+        - recursive:   whether to include the files in subdirectories.
+        - n_jobs:      threads scanning subdirectories in parallel (see tidypath.scan.scan).
     """
-    t = {}
-    today = datetime.datetime.now()
-    for f in os.listdir(parent_dir):
-        if ext is None or f.endswith(ext):
-            path = os.path.join(parent_dir, f)
-            last_update = today - pd.to_datetime(Path(path).stat().st_mtime, unit='s')
-            t[path] = last_update
-    return pd.Series(t).sort_values()
-
-def hash_path(path):
+    df = scan_frame(parent_dir, ext=ext, include_dirs=True, recursive=recursive, n_jobs=n_jobs)
+    t = pd.to_timedelta(time.time() - df["mtime"].values, unit='s')
+    return pd.Series(t, index=df["path"].values, dtype="timedelta64[ns]").sort_values()
+
+def hash_path(path, index=False):
     """
     Hashes the filename (keeping the extension and parentDir) of a path.
+    index: whether to record hashed filename -> original filename in the reverse index of parentDir (see tidypath.hash_index).
     """
     parentDir = os.path.dirname(path)
-    filename = os.path.basename(path)
-    filename, ext = os.path.splitext(filename)
+    original = os.path.basename(path)
+    filename, ext = os.path.splitext(original)
     filename = hash_string(filename)
+    if index:
+        record_hash(parentDir, f"{filename}{ext}", original)
     return os.path.join(parentDir, f"{filename}{ext}")
 
 def class_path(func, include_classes="file", skip=1):
@@ -74,39 +91,129 @@ def class_path(func, include_classes="file", skip=1):
     path = os.path.join(class_tree, func_name)
     return path
 
-def saving_path(Dir, ext, func, keys={}, subfolder="", return_dir=False, funcname_in_filename=False, iterable_maxsize=3, **kwargs):
-    """Tree path: Dir -> subfolder -> module -> (classes) -> func_name."""
+def makedirs_once(path):
+    """Creates path (and parents) the first time it is requested in this process."""
+    abspath = os.path.abspath(path)
+    if abspath not in _created_dirs:
+        Path(abspath).mkdir(exist_ok=True, parents=True)
+        _created_dirs.add(abspath)
+    return
+
+def _split_module_path(func):
+    """(directory containing the top-level package of func, path of func module inside the package)."""
     func_path = inspect.getabsfile(func).replace('.py', '')
     module_head = func.__module__.split('.')[0]
+    # Normalize the path so it uses the correct slashes for the current OS
+    normalized_path = os.path.normpath(func_path)
+
+    # Split using the OS-specific path separator (os.path.sep)
+    path_split = normalized_path.split(module_head + os.path.sep)
+    return path_split[0], path_split[1:]
+
+@lru_cache(maxsize=None)
+def root_dir(func, Dir=dataDir, subfolder=""):
+    """Root of the tree where the outputs of func (and of the rest of functions in its package) are stored: Dir -> subfolder."""
+    if func.__module__.split('.')[0] == '__main__':
+        return os.path.join(Dir, subfolder)
+    else:
+        return os.path.join(_split_module_path(func)[0], Dir, subfolder)
+
+@lru_cache(maxsize=None)
+def _parent_dir(func, Dir, subfolder, class_opts):
+    """Directory where the outputs of func are stored. Does not depend on the call arguments => computed once per (func, Dir, subfolder, class_opts)."""
+    kwargs = dict(class_opts)
+    module_head = func.__module__.split('.')[0]
     if module_head == '__main__':
-        parentDir = os.path.join(Dir,
-                                 subfolder,
+        parentDir = os.path.join(root_dir(func, Dir, subfolder),
                                  module_head,
                                  class_path(func=func, **kwargs)
                                  )
         warnings.warn(f"Module {module_head} is '__main__'. Saving in {parentDir}.", RuntimeWarning)
     else:
-        # Normalize the path so it uses the correct slashes for the current OS
-        normalized_path = os.path.normpath(func_path)
-
-        # Split using the OS-specific path separator (os.path.sep)
-        path_split = normalized_path.split(module_head + os.path.sep)
-
-        parentDir = os.path.join(path_split[0],
-                                 Dir,
-                                 subfolder,
+        parentDir = os.path.join(root_dir(func, Dir, subfolder),
                                  module_head,
-                                 *path_split[1:],
+                                 *_split_module_path(func)[1],
                                  class_path(func=func, **kwargs)
                                  )
-    Path(parentDir).mkdir(exist_ok=True, parents=True)
+    return parentDir
+
+def shard_dirs(filename, shard_levels):
+    """Hash-prefix subdirectories of filename: shard_levels directories of 2 hex characters (256 per level)."""
+    h = hash_string(filename)
+    return [h[2*i:2*i+2] for i in range(shard_levels)]
+
+def get_layout(directory, shard_levels=0):
+    """
+    Number of hash-prefix levels of directory, read from its layout marker ('.tidypath_layout'). No marker => flat (0).
+    shard_levels: layout for new directories. If > 0 and directory has no marker and no entries, the marker is created.
+                  Populated flat directories are not sharded automatically (see migrate_layout).
+    """
+    levels = _layouts.get(directory)
+    if levels is None:
+        try:
+            with open(os.path.join(directory, layout_name), 'r') as f:
+                levels = json.load(f)["shard_levels"]
+        except FileNotFoundError:
+            levels = 0
+            if shard_levels:
+                with os.scandir(directory) as it:
+                    is_empty = not any(not entry.name.startswith(".") for entry in it)
+                if is_empty:
+                    set_layout(directory, shard_levels)
+                    levels = shard_levels
+                else:
+                    warnings.warn(f"'{directory}' has a flat layout. Use 'migrate_layout' to shard it into {shard_levels} levels.", RuntimeWarning)
+        _layouts[directory] = levels
+    return levels
+
+def set_layout(directory, shard_levels):
+    """Writes the layout marker of directory. Does not move files (see migrate_layout)."""
+    with atomic_path(os.path.join(directory, layout_name)) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(shard_levels=shard_levels), f)
+    _layouts.clear() # also caches keyed by equivalent paths
+    return
+
+def layout_entries(directory):
+    """
+    Paths (relative to directory) of the stored entries, whatever the layout: 2-hex-character subdirectories are shards and are walked.
+    Hidden entries are skipped.
+    """
+    entries = []
+    pending = [""]
+    while pending:
+        subdir = pending.pop()
+        with os.scandir(os.path.join(directory, subdir)) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                elif _SHARD.fullmatch(entry.name) and entry.is_dir():
+                    pending.append(os.path.join(subdir, entry.name))
+                else:
+                    entries.append(os.path.join(subdir, entry.name))
+    return entries
+
+def saving_path(Dir, ext, func, keys={}, subfolder="", return_dir=False, funcname_in_filename=False, iterable_maxsize=3, shard_levels=0, layout=True, content_hash=False, **kwargs):
+    """
+    Tree path: Dir -> subfolder -> module -> (classes) -> func_name -> (hash-prefix shards).
+
+    shard_levels:   hash-prefix levels for new directories (see get_layout). Existing directories keep their layout.
+    layout:         whether to follow the layout of the directory. False => flat.
+    content_hash:   encode large args by their content digest (see fmt.encoder).
+    """
+    parentDir = _parent_dir(func, Dir, subfolder, tuple(sorted(kwargs.items())))
+    makedirs_once(parentDir)
     if return_dir:
         return parentDir
     else:
         if funcname_in_filename:
-            filename = os.path.basename(os.path.normpath(parentDir)) + f"_{dict_to_id(keys, iterable_maxsize=iterable_maxsize)}_.{ext}"
+            filename = os.path.basename(os.path.normpath(parentDir)) + f"_{dict_to_id(keys, iterable_maxsize=iterable_maxsize, content_hash=content_hash)}_.{ext}"
         else:
-            filename = f"{dict_to_id(keys, iterable_maxsize=iterable_maxsize)}_.{ext}"
+            filename = f"{dict_to_id(keys, iterable_maxsize=iterable_maxsize, content_hash=content_hash)}_.{ext}"
+        levels = get_layout(parentDir, shard_levels) if layout else 0
+        if levels:
+            parentDir = os.path.join(parentDir, *shard_dirs(filename, levels))
+            makedirs_once(parentDir)
         return os.path.join(parentDir, filename)
 
 def figpath(ext="png", **kwargs):
@@ -115,10 +222,159 @@ def figpath(ext="png", **kwargs):
 def datapath(ext="lzma", **kwargs):
     return saving_path(dataDir, ext, **kwargs)
 
+def func_directory(func_or_directory):
+    """
+    Directory where the outputs of a function are stored.
+
+    Attrs:
+        - func_or_directory:   function (wrapped by savedata or savefig) or directory (returned as is).
+    """
+    if callable(func_or_directory):
+        func = func_or_directory
+        if func.__out__ == "data":
+            return datapath(func=func.__wrapped__, return_dir=True)
+        else:
+            return figpath(func=func.__wrapped__, return_dir=True)
+    elif isinstance(func_or_directory, str):
+        return func_or_directory
+    else:
+        raise ValueError(f"func_or_directory {func_or_directory} not valid. Must be a function or a path.")
+
+def _rename_journal_path(directory):
+    return os.path.join(directory, rename_journal_name)
+
+def _read_rename_journal(directory):
+    """Returns ([(old, tmp, new), ...], whether the second phase started)."""
+    with open(_rename_journal_path(directory), 'r') as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    return [tuple(line) for line in lines if isinstance(line, list)], "phase2" in lines
+
+def _complete_renames(directory, entries, phase2=False):
+    """Phase 1: old -> tmp (all files). Phase 2: tmp -> new. Each step is skipped if already done => can be resumed."""
+    if not phase2:
+        for old, tmp, new in entries:
+            if not os.path.lexists(os.path.join(directory, tmp)):
+                os.rename(os.path.join(directory, old), os.path.join(directory, tmp))
+        with open(_rename_journal_path(directory), 'a') as f:
+            f.write(json.dumps("phase2") + "\n")
+    for old, tmp, new in entries:
+        if os.path.lexists(os.path.join(directory, tmp)):
+            new_path = os.path.join(directory, new)
+            os.makedirs(os.path.dirname(new_path), exist_ok=True) # hash-prefix shards
+            os.replace(os.path.join(directory, tmp), new_path)
+    return
+
+def _undo_renames(directory, entries, phase2):
+    if phase2:
+        for old, tmp, new in entries:
+            if not os.path.lexists(os.path.join(directory, tmp)) and os.path.lexists(os.path.join(directory, new)):
+                os.rename(os.path.join(directory, new), os.path.join(directory, tmp))
+    for old, tmp, new in entries:
+        if os.path.lexists(os.path.join(directory, tmp)):
+            os.replace(os.path.join(directory, tmp), os.path.join(directory, old))
+    return
+
+def _record_hashes(directory, originals):
+    """Adds {hashed relative path: original filename} to the hash indices of their directories (created if needed)."""
+    for new, original in originals.items():
+        new_dir, filename = os.path.split(os.path.join(directory, new))
+        os.makedirs(new_dir, exist_ok=True)
+        record_hash(new_dir, filename, original)
+    return
+
+def apply_renames(directory, mapping, originals={}):
+    """
+    Renames files {old_filename: new_filename} in directory as a transaction. Filenames can be relative paths (hash-prefix shards).
+
+    Files are renamed in two phases (old -> hidden temporary name -> new), so chains and swaps of names are safe.
+    The renames are written to a journal ('.tidypath_rename_journal') before touching any file. If a rename fails, the completed ones are undone.
+    If the process dies, the renames can be completed (resume_renames) or undone (rollback_renames).
+
+    originals: {new_filename: original filename} of the hashed new filenames, added to the hash index (see tidypath.hash_index) once the
+               journal is written.
+    """
+    if not mapping:
+        return
+    if os.path.exists(_rename_journal_path(directory)):
+        raise RuntimeError(f"Interrupted renames in '{directory}'. Complete them (resume_renames) or undo them (rollback_renames) first.")
+    token = uuid.uuid4().hex[:8]
+    entries = [(old, f".tidypath_rename.{token}.{i}", new) for i, (old, new) in enumerate(mapping.items())]
+    with atomic_path(_rename_journal_path(directory)) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries)
+    try:
+        targets = set(mapping.values())
+        _record_hashes(directory, {new: original for new, original in originals.items() if new in targets})
+        _complete_renames(directory, entries)
+    except BaseException:
+        _undo_renames(directory, entries, _read_rename_journal(directory)[1])
+        os.remove(_rename_journal_path(directory))
+        raise
+    os.remove(_rename_journal_path(directory))
+    from .manifest import update_manifest_renames # avoid circular import
+    update_manifest_renames(directory, dict(mapping))
+    return
+
+def resume_renames(func_or_directory):
+    """Completes the renames of an interrupted add_arg/delete_arg/modify_arg. Returns the number of renamed files."""
+    directory = func_directory(func_or_directory)
+    if not os.path.exists(_rename_journal_path(directory)):
+        return 0
+    entries, phase2 = _read_rename_journal(directory)
+    _complete_renames(directory, entries, phase2=phase2)
+    os.remove(_rename_journal_path(directory))
+    from .manifest import update_manifest_renames # avoid circular import
+    update_manifest_renames(directory, {old: new for old, _, new in entries})
+    return len(entries)
+
+def rollback_renames(func_or_directory):
+    """
+    Undoes the renames of an interrupted add_arg/delete_arg/modify_arg. Returns the number of files in the interrupted renaming.
+    NOTE: files replaced with overwrite=True cannot be restored.
+    """
+    directory = func_directory(func_or_directory)
+    if not os.path.exists(_rename_journal_path(directory)):
+        return 0
+    entries, phase2 = _read_rename_journal(directory)
+    _undo_renames(directory, entries, phase2)
+    os.remove(_rename_journal_path(directory))
+    return len(entries)
+
+def migrate_layout(func_or_directory, shard_levels):
+    """
+    Moves the stored entries of a function directory to a hash-prefix layout with shard_levels levels (0 => flat) and updates the layout marker.
+    Renames are applied as a transaction (see apply_renames). Run it while no process is using the function.
+    If interrupted, call resume_renames (or rollback_renames) and run it again.
+
+    Returns: number of moved entries.
+    """
+    directory = func_directory(func_or_directory)
+    mapping = {}
+    originals = {}
+    for file in layout_entries(directory):
+        file_dir, filename = os.path.split(file)
+        original = original_filename(os.path.join(directory, file_dir), filename)
+        new_dir = os.path.join(*shard_dirs(original, shard_levels)) if shard_levels else ""
+        if new_dir != file_dir:
+            mapping[file] = os.path.join(new_dir, filename)
+            if original != filename:
+                originals[mapping[file]] = original
+    apply_renames(directory, mapping, originals=originals)
+    set_layout(directory, shard_levels)
+    # delete emptied shards (only hidden files left: locks, manifests, hash indices)
+    for root, dirs, files in os.walk(directory, topdown=False):
+        rel = os.path.relpath(root, directory)
+        if rel != "." and all(_SHARD.fullmatch(part) for part in rel.split(os.sep)) and all(f.startswith(".") for f in os.listdir(root)):
+            shutil.rmtree(root, ignore_errors=True)
+    return len(mapping)
+
 def filename_modifier(process_filename, func_or_directory=None, check_first=True, overwrite=False, **args):
     """
     Base function for adding/deleting/modifying function args encoded in the output filenames.
 
+    The directory is scanned once and the new filenames are computed for all args together. Conflicts are detected before renaming any file.
+    Renames are applied as a transaction (see apply_renames).
+
     Attrs:
         - process_filename:    function f(file, k_name, k, v) -> new_filename.
                                - k, v are the key and value of an arg.
@@ -130,57 +386,75 @@ def filename_modifier(process_filename, func_or_directory=None, check_first=True
                                Examples:   add/modify/delete an arg -> two filenames are the same -> one remains.
         - args (kwargs):       Arguments to add/delete/modify in the filename.
     """
-    if callable(func_or_directory):
-        func = func_or_directory
-        if func.__out__ == "data":
-            directory = datapath(func=func.__wrapped__, return_dir=True)
-        else:
-            directory = figpath(func=func.__wrapped__, return_dir=True)
-    elif isinstance(func_or_directory, str):
-        directory = func_or_directory
-    else:
-        raise ValueError(f"func_or_directory {func_or_directory} not valid. Must be a function or a path.")
+    directory = func_directory(func_or_directory)
+    database, prefix = find_database(directory) # entries stored by the sqlite backends
 
     args_sorted = {k: args[k] for k in sorted(args)}
-    abort_changes = False
+    k_names = {k: encoder(k).replace("_", "-") for k in args_sorted}
     avoid_files = [".ipynb_checkpoints", "__pycache__"]
-    for k, v in args_sorted.items():
-        check_first_k = deepcopy(check_first)
-        print_long_filename_k = deepcopy(check_first)
-        if abort_changes:
-            break
-        else:
-            k_name = encoder(k).replace("_", "-")
-            for file in os.listdir(directory):
-                if file not in avoid_files:
-                    new_filename = process_filename(file, k_name, k, v)
-                    if new_filename is not None:
-                        if len(new_filename) > 255:
-                            if print_long_filename_k:
-                                new_filename_hashed = hash_path(new_filename)
-                                warnings.warn(f"Filename too long for '{file}'. Hashed to '{new_filename_hashed}'. Warning will not be shown again.", RuntimeWarning)
-                                print_long_filename_k = False
-                                new_filename = new_filename_hashed
-                            else:
-                                new_filename = hash_path(new_filename)
-                        new_path = os.path.join(directory, new_filename)
-                        if Path(new_path).exists() and not overwrite:
-                            raise RuntimeError(f"'{new_filename}' already existing before modifying '{file}'. To delete repeated files pass 'overwrite=True'.")
-                        else:
-                            if check_first_k:
-                                update_file = 0
-                                while update_file not in ["y", "yes", "n", "no"]:
-                                    update_file = input("Filename change example:\n\n'{}' -> '{}'\n\nProceed? [y/n]".format(file, new_filename)).lower()
-                                check_first_k = False
-                            else:
-                                update_file = "y"
-                            if update_file in ["y", "yes"]:
-                                os.rename(os.path.join(directory, file),
-                                          new_path)
-                            else:
-                                warnings.warn("Aborted filename changes.", RuntimeWarning)
-                                abort_changes = True
-                                break
+    files = [file for file in layout_entries(directory) if os.path.basename(file) not in avoid_files] # hidden: tidypath manifest, locks, temporary files
+    levels = get_layout(directory)
+    stored = [] if database is None else [key[len(prefix):] for key in database.keys(prefix) if "/" not in key[len(prefix):]]
+
+    max_str_length = getattr(func_or_directory, "max_str_length", None)
+    if max_str_length is None:
+        is_too_long = lambda filename: len(filename) > 255
+    else: # same criterion as the decorator
+        is_too_long = lambda filename: len(filename) + len(os.path.splitext(filename)[1]) > max_str_length
+
+    # plan (no side effects: directories and hash index records are created when the renames are applied)
+    renames = {}
+    originals = {} # hashed new filename -> original new filename
+    warn_long_filename = True
+    n_files = len(files)
+    for i, file in enumerate([*files, *stored]):
+        file_dir, new_filename = os.path.split(file)
+        new_filename = original_filename(os.path.join(directory, file_dir), new_filename) # hashed filenames => original ones, from the reverse index
+        for k, v in args_sorted.items():
+            new_filename = process_filename(new_filename, k_names[k], k, v) or new_filename
+        new_dir = os.path.join(*shard_dirs(new_filename, levels)) if levels and i < n_files else "" # database keys are not sharded
+        original = new_filename
+        if is_too_long(new_filename):
+            new_filename = os.path.basename(hash_path(new_filename))
+            if warn_long_filename:
+                warnings.warn(f"Filename too long for '{file}'. Hashed to '{new_filename}'. Warning will not be shown again.", RuntimeWarning)
+                warn_long_filename = False
+        new_filename = os.path.join(new_dir, new_filename)
+        if original != os.path.basename(new_filename):
+            originals[new_filename] = original
+        if new_filename != file:
+            renames[file] = new_filename
+    if not renames:
+        return
+
+    # conflicts
+    existing = {*files, *stored}
+    targets = set()
+    for file, new_filename in renames.items():
+        if (new_filename in targets or (new_filename in existing and new_filename not in renames)) and not overwrite:
+            raise RuntimeError(f"'{new_filename}' already existing before modifying '{file}'. To delete repeated files pass 'overwrite=True'.")
+        targets.add(new_filename)
+
+    if check_first:
+        file, new_filename = next(iter(renames.items()))
+        update_file = 0
+        while update_file not in ["y", "yes", "n", "no"]:
+            update_file = input("Filename change example ({} files):\n\n'{}' -> '{}'\n\nProceed? [y/n]".format(len(renames), file, new_filename)).lower()
+        if update_file in ["n", "no"]:
+            warnings.warn("Aborted filename changes.", RuntimeWarning)
+            return
+
+    stored = set(stored)
+    file_renames = {file: new_filename for file, new_filename in renames.items() if file not in stored}
+    apply_renames(directory, file_renames, originals=originals)
+    if database is not None:
+        try:
+            db_renames = {key: new_key for key, new_key in renames.items() if key in stored}
+            database.rename({prefix + key: prefix + new_key for key, new_key in db_renames.items()}, overwrite=overwrite)
+        except BaseException:
+            apply_renames(directory, {new_filename: file for file, new_filename in file_renames.items()})
+            raise
+        _record_hashes(directory, {new_key: originals[new_key] for new_key in db_renames.values() if new_key in originals})
     return
 
 def add_arg(func_or_directory=None, check_first=True, overwrite=False, **args):
@@ -202,15 +476,15 @@ def add_arg(func_or_directory=None, check_first=True, overwrite=False, **args):
         arg_val = dict_to_id({k:v})
         new_filename = None
         if arg_val not in file:
-            args_in_file = np.sort(os.path.splitext(file)[0].split("_")[:-1] + [k])
-            pos_new_arg = np.where(args_in_file == k)[0][0]
+            args_in_file = sorted(os.path.splitext(file)[0].split("_")[:-1])
+            pos_new_arg = bisect_left(args_in_file, k)
             if pos_new_arg == 0:
                 new_filename = f"{arg_val}_{file}"
             else:
-                if pos_new_arg + 1 == len(args_in_file):
+                if pos_new_arg == len(args_in_file):
                     insert_before = "."
                 else:
-                    insert_before = args_in_file[pos_new_arg + 1]
+                    insert_before = args_in_file[pos_new_arg]
                 new_filename = file.replace(f"_{insert_before}", f"_{arg_val}_{insert_before}")
             if new_filename == file:
                 new_filename = None
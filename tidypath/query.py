@@ -0,0 +1,89 @@
+"""
+Bulk queries over the stored results of a 'savedata'-wrapped function. Available as func.cached(**partial_key).
+
+Entries are matched against the encoded partial key before decoding, so only the matching filenames are decoded (in one pass, see fmt.ids_to_frame).
+Hashed filenames are resolved with the reverse index (tidypath.hash_index). Sharded layouts and sqlite backends are supported.
+"""
+import os
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from . import database
+from .fmt import dict_to_id, ids_to_frame
+from .hash_index import original_filename
+from .paths import layout_entries
+
+class CachedResults():
+    """
+    Stored results of a function matching a partial key.
+
+    Attrs:
+        - table:    DataFrame. One row per stored result: decoded args (one column per arg), 'ext' and 'path' (saving path).
+    """
+    def __init__(self, table, loader):
+        self.table = table
+        self._loader = loader
+
+    def __len__(self):
+        return len(self.table)
+
+    def __repr__(self):
+        return repr(self.table)
+
+    def _repr_html_(self):
+        return self.table._repr_html_()
+
+    @property
+    def paths(self):
+        return self.table["path"].tolist()
+
+    def load(self, n_jobs=None):
+        """
+        Loads the results, in the order of the table.
+        n_jobs: number of threads. None => ThreadPoolExecutor default. 1 => sequential.
+        Returns: list.
+        """
+        args = list(zip(self.table["ext"], self.table["path"]))
+        if n_jobs == 1 or len(args) < 2:
+            return [self._loader(ext, path) for ext, path in args]
+        with ThreadPoolExecutor(max_workers=n_jobs, thread_name_prefix="tidypath-load") as executor:
+            return list(executor.map(lambda a: self._loader(*a), args))
+
+def stored_entries(directory, backend="files", db_root=None):
+    """Saving paths of the results stored for a function directory."""
+    if backend == "files":
+        return [os.path.join(directory, file) for file in layout_entries(directory)]
+    else:
+        db_dir, key = database.location(os.path.join(directory, "_"), db_root)
+        prefix = key[:-1]
+        return [os.path.join(directory, k[len(prefix):]) for k in database.get_database(db_dir).keys(prefix) if "/" not in k[len(prefix):]]
+
+def cached_results(directory, partial_key, ext, loader, backend="files", db_root=None, iterable_maxsize=3, content_hash=False):
+    """
+    Stored results of the function directory whose key matches partial_key.
+
+    Attrs:
+        - partial_key:   {arg: value}. Values are compared in their filename encoding (see fmt.dict_to_id).
+        - ext:           str or list of str. Extensions of the results.
+        - loader:        function (ext, saving_path) -> result.
+
+    Returns: CachedResults.
+    """
+    exts = [ext] if isinstance(ext, str) else list(ext)
+    suffixes = tuple(f".{e}" for e in exts)
+    tokens = [f"_{dict_to_id({k: v}, iterable_maxsize=iterable_maxsize, content_hash=content_hash)}_" for k, v in partial_key.items()]
+    filenames, file_exts, paths = [], [], []
+    for path in sorted(stored_entries(directory, backend=backend, db_root=db_root)):
+        parent_dir, filename = os.path.split(path)
+        filename = original_filename(parent_dir, filename)
+        if not filename.endswith(suffixes):
+            continue
+        stem, file_ext = os.path.splitext(filename)
+        if all(token in f"_{stem}" for token in tokens):
+            filenames.append(filename)
+            file_exts.append(file_ext[1:])
+            paths.append(path)
+    if filenames:
+        table = ids_to_frame(filenames).rename(columns=lambda k: k.replace("-", "_")).assign(ext=file_exts, path=paths)
+    else:
+        table = pd.DataFrame(columns=[*partial_key, "ext", "path"])
+    return CachedResults(table, loader)
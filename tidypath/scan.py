@@ -0,0 +1,84 @@
+"""
+Filesystem scanner shared by the inventory and cleanup utilities (time_since_last_update, delete_files_newer_than, ...).
+
+Based on os.scandir: file types come from the directory listing and each entry is stat'ed once (DirEntry.stat).
+Subtrees can be walked in parallel threads, which pays off on network filesystems and large trees.
+"""
+import os
+import pandas as pd
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+FileRecord = namedtuple("FileRecord", ["path", "name", "size", "mtime", "is_dir"])
+
+def _scan_dir(directory, ext, include_hidden, include_dirs, recursive, onerror):
+    """Records of the entries of directory and its subdirectories (to be scanned next)."""
+    records = []
+    subdirs = []
+    try:
+        it = os.scandir(directory)
+    except OSError as e:
+        if onerror is not None:
+            onerror(e)
+        return records, subdirs
+    with it:
+        for entry in it:
+            name = entry.name
+            if not include_hidden and name.startswith("."):
+                continue
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_dir and recursive:
+                    subdirs.append(entry.path)
+                if (is_dir and not include_dirs) or (ext is not None and not name.endswith(ext)):
+                    continue
+                if not is_dir and not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError as e: # removed while scanning, permissions
+                if onerror is not None:
+                    onerror(e)
+                continue
+            records.append(FileRecord(entry.path, name, st.st_size, st.st_mtime, is_dir))
+    return records, subdirs
+
+def scan(directory, recursive=False, ext=None, include_hidden=True, include_dirs=False, n_jobs=1, onerror=None):
+    """
+    Yields a FileRecord (path, name, size, mtime, is_dir) for each file in directory.
+
+    Attrs:
+        - directory:        directory to scan.
+        - recursive:        whether to scan subdirectories.
+        - ext:              str or tuple of str. Only entries whose name ends with ext. None => all.
+        - include_hidden:   whether to include entries starting with '.' (tidypath manifest, locks, temporary files). Hidden directories are not walked if False.
+        - include_dirs:     whether to yield records for directories too.
+        - n_jobs:           number of threads walking subdirectories in parallel. Records are yielded as directories are scanned (unordered).
+        - onerror:          function called with the OSError raised by unreadable directories/entries. None => ignore them.
+
+    Returns: generator.
+    """
+    if isinstance(ext, list):
+        ext = tuple(ext)
+    opts = dict(ext=ext, include_hidden=include_hidden, include_dirs=include_dirs, recursive=recursive, onerror=onerror)
+    if n_jobs == 1 or not recursive:
+        pending = [directory]
+        while pending:
+            records, subdirs = _scan_dir(pending.pop(), **opts)
+            yield from records
+            pending.extend(subdirs[::-1])
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs, thread_name_prefix="tidypath-scan") as executor:
+            futures = {executor.submit(_scan_dir, directory, **opts)}
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    records, subdirs = future.result()
+                    futures.update(executor.submit(_scan_dir, subdir, **opts) for subdir in subdirs)
+                    yield from records
+
+def scan_frame(directory, **kwargs):
+    """
+    DataFrame with the records of 'scan' (columns: path, name, size, mtime, is_dir). mtime is a UNIX timestamp (seconds).
+    kwargs: passed to 'scan'.
+    """
+    return pd.DataFrame.from_records(list(scan(directory, **kwargs)), columns=FileRecord._fields)
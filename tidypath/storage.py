@@ -9,15 +9,37 @@ from copy import deepcopy
 from pathlib import Path
 import time
 import datetime
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Union
 import pickle
 import bz2
 import lzma
+import gzip
 import json
 import zipfile
+import uuid
+import shutil
+import struct
+import mmap
+import operator
+import inspect
+import warnings
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from collections import namedtuple
+from importlib.util import find_spec
+from . import config
+from .scan import scan_frame
 
 parent_dir =  'data'
 
+PKL5_MAGIC = b"TIDYPKL5"
+PKL5_ALIGNMENT = 64
+PARQUET_MAGIC = b"PAR1"
+ARROW_MAGIC = b"ARROW1"
+
+_HAVE_PYARROW = find_spec("pyarrow") is not None
+
 
 ##############################################################################################################################
 """                                                       I. Save                                                          """
@@ -44,21 +66,179 @@ def save_preprocess(filename, saving_type, parent_dir):
     filename = filename if filename.endswith('.{}'.format(saving_type)) else '{}.{}'.format(filename, saving_type)
     return parent_dir, filename
 
+@contextmanager
+def atomic_path(path):
+    """
+    Yields a temporary path in the same directory as path. If the block succeeds, the temporary file replaces path (os.replace).
+    Readers never see partially written files.
+    """
+    _parent_dir, _filename = os.path.split(path)
+    tmp_path = os.path.join(_parent_dir, f".{_filename[:200]}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+    os.close(os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+@contextmanager
+def atomic_dir(path):
+    """
+    Directory version of atomic_path. Yields a temporary directory that replaces path if the block succeeds.
+    An existing directory at path is moved aside and deleted after the replacement.
+    """
+    _parent_dir, _dirname = os.path.split(path)
+    tmp_path = os.path.join(_parent_dir, f".{_dirname[:200]}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+    os.mkdir(tmp_path)
+    try:
+        yield tmp_path
+        if os.path.exists(path):
+            old_path = f"{tmp_path}.old"
+            os.replace(path, old_path)
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
 def create_saving_func(file_opener, file_writer, saving_type, **kwargs):
     def saving_func(data, filename, parent_dir=parent_dir):
         """Can specify directory in filename or in parent_dir."""
         parent_dir, filename = save_preprocess(filename, saving_type, parent_dir)
-        with file_opener(os.path.join(parent_dir, filename), 'w') as f:
-            file_writer(data, f, **kwargs)
+        with atomic_path(os.path.join(parent_dir, filename)) as tmp_path:
+            with file_opener(tmp_path, 'w') as f:
+                file_writer(data, f, **kwargs)
         return
     return saving_func
 
 save_json = create_saving_func(open, json.dump, 'json', cls=NpEncoder)
-save_bz2 = create_saving_func(bz2.BZ2File, pickle.dump, 'pbz2')
-save_lzma = create_saving_func(lzma.LZMAFile, pickle.dump, 'lzma')
 
 def save_npz(arr, filename, parent_dir=parent_dir, key="arr"):
-    np.savez_compressed(os.path.join(parent_dir, filename), **{key:arr})
+    parent_dir, filename = save_preprocess(filename, "npz", parent_dir)
+    with atomic_path(os.path.join(parent_dir, filename)) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **{key:arr})
+    return
+
+def save_npy(arr, filename, parent_dir=parent_dir):
+    """Uncompressed .npy file. Can be loaded memory-mapped (see load_npy)."""
+    parent_dir, filename = save_preprocess(filename, "npy", parent_dir)
+    with atomic_path(os.path.join(parent_dir, filename)) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            np.save(f, arr)
+    return
+
+def save_npydir(data, filename, parent_dir=parent_dir):
+    """
+    Stores a dict of arrays in a directory: one uncompressed .npy file per array, plus 'keys.json' with the dict keys.
+    Arrays can be loaded memory-mapped (see load_npydir).
+    If data is an array, it is stored with key 'arr'.
+    """
+    if isinstance(data, np.ndarray):
+        data = {"arr": data}
+    parent_dir, filename = save_preprocess(filename, "npydir", parent_dir)
+    with atomic_dir(os.path.join(parent_dir, filename)) as tmp_path:
+        for i, arr in enumerate(data.values()):
+            with open(os.path.join(tmp_path, f"{i}.npy"), 'wb') as f:
+                np.save(f, arr)
+        with open(os.path.join(tmp_path, "keys.json"), 'w') as f:
+            json.dump(list(data.keys()), f, cls=NpEncoder)
+    return
+
+def save_pkl5(data, filename, parent_dir=parent_dir, min_oob_bytes=2**16):
+    """
+    Pickle protocol 5 with out-of-band buffers (numpy arrays, pandas blocks, bytearrays, ...).
+    Large buffers are written directly from memory after the pickle stream, without being copied into it.
+
+    File layout: PKL5_MAGIC | number of buffers, pickle length (uint64) | (offset, length) of each buffer (uint64) | pickle | buffers.
+    Buffers are aligned to PKL5_ALIGNMENT bytes.
+
+    min_oob_bytes: buffers smaller than this are kept in the pickle stream.
+    """
+    parent_dir, filename = save_preprocess(filename, "pkl5", parent_dir)
+    with atomic_path(os.path.join(parent_dir, filename)) as tmp_path:
+        _write_pkl5(data, tmp_path, min_oob_bytes=min_oob_bytes)
+    return
+
+def _write_pkl5(data, file_path, min_oob_bytes=2**16):
+    buffers = []
+    def buffer_callback(buffer):
+        try:
+            raw = buffer.raw()
+        except BufferError: # non-contiguous => in-band
+            return True
+        if raw.nbytes < min_oob_bytes:
+            return True
+        buffers.append(raw)
+        return False
+
+    pickled = pickle.dumps(data, protocol=5, buffer_callback=buffer_callback)
+    header_size = len(PKL5_MAGIC) + 16 + 16 * len(buffers)
+    offsets = []
+    offset = header_size + len(pickled)
+    for raw in buffers:
+        offset += -offset % PKL5_ALIGNMENT
+        offsets.append(offset)
+        offset += raw.nbytes
+    header = PKL5_MAGIC + struct.pack(f"<{2 + 2*len(buffers)}Q", len(buffers), len(pickled), *(x for o, raw in zip(offsets, buffers) for x in (o, raw.nbytes)))
+
+    with open(file_path, 'wb') as f:
+        f.write(header)
+        f.write(pickled)
+        for o, raw in zip(offsets, buffers):
+            f.write(b"\0" * (o - f.tell()))
+            f.write(raw)
+    return
+
+def _to_frame(data):
+    if isinstance(data, pd.Series):
+        return data.to_frame()
+    elif isinstance(data, pd.DataFrame):
+        return data
+    else:
+        raise TypeError(f"data must be a pandas DataFrame or Series. Received {type(data)}.")
+
+def _save_pickle_fallback(df, file_path, fmt):
+    warnings.warn(f"pyarrow not installed. Storing DataFrame as a pickle ({config.CODEC_DEFAULT_DATA}) instead of {fmt}. load_{fmt} reads both.", RuntimeWarning)
+    with get_codec(config.CODEC_DEFAULT_DATA).open(file_path, 'wb') as f:
+        pickle.dump(df, f)
+    return
+
+def save_parquet(df, filename, parent_dir=parent_dir, **kwargs):
+    """
+    Stores a DataFrame (or Series, as a 1-column DataFrame) in Parquet format. Columns and row groups can be loaded selectively (see load_parquet).
+    kwargs: passed to pyarrow.parquet.write_table. Example: compression='zstd', row_group_size=100000.
+    If pyarrow is not installed, the DataFrame is pickled instead.
+    """
+    df = _to_frame(df)
+    parent_dir, filename = save_preprocess(filename, "parquet", parent_dir)
+    with atomic_path(os.path.join(parent_dir, filename)) as tmp_path:
+        if _HAVE_PYARROW:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.Table.from_pandas(df), tmp_path, **kwargs)
+        else:
+            _save_pickle_fallback(df, tmp_path, "parquet")
+    return
+
+def save_feather(df, filename, parent_dir=parent_dir, **kwargs):
+    """
+    Stores a DataFrame (or Series, as a 1-column DataFrame) in Feather (Arrow IPC) format. Loading is memory-mapped and columns can be selected.
+    kwargs: passed to pyarrow.feather.write_feather. Example: compression='uncompressed' (fastest loading), 'lz4', 'zstd'.
+    If pyarrow is not installed, the DataFrame is pickled instead.
+    """
+    df = _to_frame(df)
+    parent_dir, filename = save_preprocess(filename, "feather", parent_dir)
+    with atomic_path(os.path.join(parent_dir, filename)) as tmp_path:
+        if _HAVE_PYARROW:
+            import pyarrow.feather as feather
+            feather.write_feather(df, tmp_path, **kwargs)
+        else:
+            _save_pickle_fallback(df, tmp_path, "feather")
     return
 
 def save_csv(data, filename, parent_dir=parent_dir, **kwargs):
@@ -68,11 +248,11 @@ def save_csv(data, filename, parent_dir=parent_dir, **kwargs):
     (required by np.savetxt)
     """
     parent_dir, filename = save_preprocess(filename, "csv", parent_dir)
-    file_path = os.path.join(parent_dir, filename)
-    if isinstance(data, (pd.core.frame.DataFrame, pd.core.series.Series)):
-        data.to_csv(file_path, **kwargs)
-    else:
-        np.savetxt(file_path, data, delimiter=',', **kwargs)
+    with atomic_path(os.path.join(parent_dir, filename)) as file_path:
+        if isinstance(data, (pd.core.frame.DataFrame, pd.core.series.Series)):
+            data.to_csv(file_path, **kwargs)
+        else:
+            np.savetxt(file_path, data, delimiter=',', **kwargs)
     return
 
 
@@ -90,39 +270,152 @@ def create_loading_func(file_opener, file_loader, extra_processing=None, apply_d
             with file_opener(path, 'rb') as f:
                 return file_loader(f)
     else:
-        def loading_func(path):
-            args = {key:val for key,val in locals().items() if key not in  ('path', *create_loading_func.__code__.co_varnames)}
+        def loading_func(path, **kwargs):
+            unexpected = set(kwargs) - set(apply_defaults)
+            if unexpected:
+                raise TypeError(f"loading_func got unexpected keyword arguments {sorted(unexpected)}. Available: {list(apply_defaults)}.")
+            conditions = {**apply_defaults, **kwargs}
             with file_opener(path, 'rb') as f:
                 data = file_loader(f)
 
-            for condition, process in zip(args.values(), extra_processing):
-                if condition:
+            for key, process in zip(apply_defaults, extra_processing):
+                if conditions[key]:
                     data = process(data)
             return data
 
-        # I know this sould not be done this way, but I wanted to check it can
-        code_data = loading_func.__code__
-        num_vars = code_data.co_argcount
-        num_vars_new = len(apply_defaults)
-        new_code = code_data.replace(co_varnames=(*code_data.co_varnames[:num_vars], *apply_defaults.keys(), *code_data.co_varnames[num_vars:]),
-                                     co_argcount=num_vars + num_vars_new,
-                                     co_nlocals=code_data.co_nlocals + num_vars_new)
-        loading_func.__code__ = new_code
-        loading_func.__defaults__ = tuple(apply_defaults.values())
+        loading_func.__signature__ = inspect.Signature([inspect.Parameter("path", inspect.Parameter.POSITIONAL_OR_KEYWORD),
+                                                        *(inspect.Parameter(k, inspect.Parameter.POSITIONAL_OR_KEYWORD, default=v) for k, v in apply_defaults.items())])
     return loading_func
 
 def int_keys(dictionary):
      return {int(key):val for key,val in dictionary.items()}
 
 load_json = create_loading_func(open, json.load, extra_processing=[int_keys], apply_defaults={'int_keys':True})
-load_bz2 = create_loading_func(bz2.BZ2File, pickle.load)
-load_lzma = create_loading_func(lzma.LZMAFile, pickle.load)
 
 def load_npz(path, key=None):
     data = np.load(path)
     key = [*data.keys()][0] if key is None else key
     return data[key]
 
+def load_npy(path, mmap_mode="r"):
+    """
+    Loads a .npy file.
+    mmap_mode: 'r' (default), 'r+', 'c' => memory-mapped array (no copy, pages shared between processes).
+               None                    => array loaded in memory.
+    """
+    return np.load(path, mmap_mode=mmap_mode)
+
+def load_npydir(path, mmap_mode="r", keys=None):
+    """
+    Loads a dict of arrays stored by save_npydir.
+    mmap_mode: see load_npy.
+    keys:      subset of keys to load. None => all.
+    """
+    with open(os.path.join(path, "keys.json"), 'r') as f:
+        stored_keys = json.load(f)
+    return {k: np.load(os.path.join(path, f"{i}.npy"), mmap_mode=mmap_mode) for i, k in enumerate(stored_keys) if keys is None or k in keys}
+
+def load_pkl5(path, mmap_mode=None, **kwargs):
+    """
+    Loads a file stored by save_pkl5. Out-of-band buffers are not copied: objects are rebuilt on top of the file contents.
+    mmap_mode: None  => the file is read once into memory.
+               'r'   => memory-mapped, read-only (arrays are not writeable).
+               'c'   => memory-mapped, copy-on-write.
+    kwargs: saving options (min_oob_bytes). Ignored.
+    """
+    with open(path, 'rb') as f:
+        if mmap_mode is None:
+            data = bytearray(os.fstat(f.fileno()).st_size)
+            f.readinto(data)
+        elif mmap_mode in ("r", "c"):
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ if mmap_mode == "r" else mmap.ACCESS_COPY)
+        else:
+            raise ValueError(f"mmap_mode {mmap_mode} not valid. Available: None, 'r', 'c'.")
+    view = memoryview(data)
+    if bytes(view[:len(PKL5_MAGIC)]) != PKL5_MAGIC:
+        raise pickle.UnpicklingError(f"'{path}' is not a pkl5 file.")
+    start = len(PKL5_MAGIC)
+    num_buffers, pickle_size = struct.unpack_from("<2Q", view, start)
+    start += 16
+    buffer_specs = struct.unpack_from(f"<{2*num_buffers}Q", view, start)
+    start += 16 * num_buffers
+    buffers = [view[o:o+n] for o, n in zip(buffer_specs[::2], buffer_specs[1::2])]
+    return pickle.loads(view[start:start+pickle_size], buffers=buffers)
+
+_filter_ops = {"=": operator.eq, "==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+               "in": lambda s, v: s.isin(v), "not in": lambda s, v: ~s.isin(v)}
+
+def apply_filters(df, filters):
+    """
+    Row selection with pyarrow-style filters.
+    filters: list of (column, op, value) tuples, combined with AND, or list of such lists, combined with OR.
+             op: '=', '==', '!=', '<', '<=', '>', '>=', 'in', 'not in'.
+    """
+    if not filters:
+        return df
+    if isinstance(filters[0], tuple):
+        filters = [filters]
+    mask = np.zeros(len(df), dtype=bool)
+    for conjunction in filters:
+        mask_i = np.ones(len(df), dtype=bool)
+        for column, op, value in conjunction:
+            mask_i &= np.asarray(_filter_ops[op](df[column], value))
+        mask |= mask_i
+    return df[mask]
+
+def _filter_columns(filters):
+    if not filters:
+        return []
+    if isinstance(filters[0], tuple):
+        filters = [filters]
+    return list({column for conjunction in filters for column, _, _ in conjunction})
+
+def _load_pickle_fallback(path, columns, filters):
+    df = apply_filters(load_pkl(path), filters)
+    return df if columns is None else df[columns]
+
+def load_parquet(path, columns=None, filters=None, **kwargs):
+    """
+    Loads a DataFrame stored by save_parquet.
+    columns:   columns to load. None => all.
+    filters:   row filters (see apply_filters). With pyarrow, row groups not matching the filters are skipped.
+    kwargs:    saving options. Ignored.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(len(PARQUET_MAGIC))
+    if header != PARQUET_MAGIC:
+        return _load_pickle_fallback(path, columns, filters)
+    elif _HAVE_PYARROW:
+        import pyarrow.parquet as pq
+        return pq.read_pandas(path, columns=columns, filters=filters).to_pandas()
+    else:
+        return pd.read_parquet(path, columns=columns, filters=filters)
+
+def load_feather(path, columns=None, filters=None, **kwargs):
+    """
+    Loads a DataFrame stored by save_feather. The file is memory-mapped.
+    columns:   columns to load. None => all.
+    filters:   row filters (see apply_filters).
+    kwargs:    saving options. Ignored.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(len(ARROW_MAGIC))
+    if header != ARROW_MAGIC:
+        return _load_pickle_fallback(path, columns, filters)
+    elif not _HAVE_PYARROW:
+        raise ImportError("pyarrow is required for loading feather files.")
+    import pyarrow.feather as feather
+    if columns is None:
+        table = feather.read_table(path, memory_map=True)
+    else:
+        import pyarrow as pa
+        with pa.memory_map(path) as source:
+            pandas_metadata = pa.ipc.open_file(source).schema.pandas_metadata or {}
+        index_columns = [c for c in pandas_metadata.get("index_columns", []) if isinstance(c, str)]
+        table = feather.read_table(path, columns=list(dict.fromkeys([*columns, *_filter_columns(filters), *index_columns])), memory_map=True)
+    df = apply_filters(table.to_pandas(), filters)
+    return df if columns is None else df[columns]
+
 def load_csv(path, mode="pandas", **kwargs):
     if mode == "pandas":
         return pd.read_csv(path, **kwargs)
@@ -133,105 +426,377 @@ def load_csv(path, mode="pandas", **kwargs):
 
 
 ##############################################################################################################################
-"""                                                   III. Compression                                                     """
+"""                                                     III. Codecs                                                        """
 ##############################################################################################################################
 
-def compress_files(rootDir=parent_dir, extension='.json', compress_to='lzma', min_size=0, loading_key=None):
+Codec = namedtuple("Codec", ["name", "ext", "open", "compress", "decompress", "magic"])
+codecs = {}
+
+def register_codec(name, open, compress, decompress, ext=None, magic=None, aliases=()):
     """
-    Searches in a directory and all its subdirectories files with a certain extension and compresses them.
+    Registers a compression codec for pickled data.
+
+    Attrs:
+        - name:         codec name. Used by the 'codec' option of the saving functions.
+        - open:         open(path, mode, level=None, threads=None) -> file object. mode is 'rb' or 'wb'.
+        - compress:     compress(data: bytes, level=None, threads=None) -> bytes.
+        - decompress:   decompress(data: bytes) -> bytes.
+        - ext:          file extension. If given, defines the storage functions save_{ext}, load_{ext} => usable as savedata(ext=ext).
+        - magic:        leading bytes of the compressed files. Used for detecting the codec when loading.
+        - aliases:      alternative names.
+    """
+    codec = Codec(name=name, ext=ext, open=open, compress=compress, decompress=decompress, magic=magic)
+    for codec_name in (name, *aliases):
+        codecs[codec_name] = codec
+    if ext is not None:
+        globals()[f"save_{ext}"] = create_codec_saving_func(ext, codec=name)
+        globals()[f"load_{ext}"] = load_pkl
+    return codec
+
+def get_codec(name):
+    if name not in codecs:
+        raise ValueError(f"codec '{name}' not available. Registered: {sorted(codecs)}.")
+    return codecs[name]
+
+def detect_codec(header):
+    """Codec whose magic bytes match the file header. Uncompressed pickles => 'none'."""
+    for codec in codecs.values():
+        if codec.magic is not None and header.startswith(codec.magic):
+            return codec
+    return codecs["none"]
+
+def create_codec_saving_func(saving_type, codec=None):
+    def saving_func(data, filename, parent_dir=parent_dir, codec=codec, level=None, threads=None):
+        """
+        Pickles data and compresses it. Can specify directory in filename or in parent_dir.
+        codec:     registered codec (storage.codecs). None => config.CODEC_DEFAULT_DATA.
+        level:     compression level (codec specific). None => codec default.
+        threads:   compression threads, for codecs supporting it (zstd). None => single-threaded.
+        """
+        codec = get_codec(config.CODEC_DEFAULT_DATA if codec is None else codec)
+        parent_dir, filename = save_preprocess(filename, saving_type, parent_dir)
+        with atomic_path(os.path.join(parent_dir, filename)) as tmp_path:
+            with codec.open(tmp_path, 'wb', level=level, threads=threads) as f:
+                pickle.dump(data, f)
+        return
+    return saving_func
 
-    Attributes:
-    - rootDir: The root directory.
-    - extension: Extension setting which files should be compressed. Available options: '.json', '.npz'.
-    - compress_to: File type after compression. Available options: 'lzma', 'bz2' (or pbz2).
-    - min_size: Minimum size for applying compression (in MB).
-    - loading_key: Key for retrieving the data in a npz file. If None, retrieves the data corresponding to the first key.
+def load_pkl(path, **kwargs):
+    """
+    Loads pickled data compressed with any registered codec (detected from the file header).
+    kwargs: saving options (codec, level, threads). Ignored.
+    """
+    with open(path, 'rb') as f:
+        codec = detect_codec(f.read(8))
+    with codec.open(path, 'rb') as f:
+        return pickle.load(f)
+
+def _open_lzma(path, mode, level=None, threads=None):
+    return lzma.open(path, mode, preset=level if 'w' in mode else None)
+
+def _open_gzip(path, mode, level=None, threads=None):
+    return gzip.open(path, mode, compresslevel=6 if level is None else level)
+
+def _open_bz2(path, mode, level=None, threads=None):
+    return bz2.open(path, mode, compresslevel=9 if level is None else level)
+
+def _open_none(path, mode, level=None, threads=None):
+    return open(path, mode)
+
+register_codec("none", _open_none, lambda data, level=None, threads=None: data, lambda data: data)
+register_codec("lzma", _open_lzma, lambda data, level=None, threads=None: lzma.compress(data, preset=level), lzma.decompress,
+               ext="lzma", magic=b"\xfd7zXZ\x00", aliases=("xz",))
+register_codec("bz2", _open_bz2, lambda data, level=None, threads=None: bz2.compress(data, 9 if level is None else level), bz2.decompress,
+               ext="pbz2", magic=b"BZh")
+register_codec("gzip", _open_gzip, lambda data, level=None, threads=None: gzip.compress(data, 6 if level is None else level), gzip.decompress,
+               ext="gz", magic=b"\x1f\x8b", aliases=("zlib",))
+save_bz2 = save_pbz2
+load_bz2 = load_pbz2
+save_pkl = create_codec_saving_func("pkl") # codec chosen by the 'codec' option, default config.CODEC_DEFAULT_DATA
+
+if find_spec("zstandard") is not None:
+    import zstandard
+
+    def _zstd_compressor(level=None, threads=None):
+        return zstandard.ZstdCompressor(level=3 if level is None else level, threads=0 if threads is None else threads)
+
+    def _open_zstd(path, mode, level=None, threads=None):
+        if 'w' in mode:
+            return zstandard.open(path, mode, cctx=_zstd_compressor(level, threads))
+        else:
+            return zstandard.open(path, mode)
 
-    Returns: Dict containing the name of the files that could not be processed ('bad compression') or those that were corrupted and had to be deleted('deleted files').
+    register_codec("zstd", _open_zstd, lambda data, level=None, threads=None: _zstd_compressor(level, threads).compress(data),
+                   lambda data: zstandard.ZstdDecompressor().decompress(data),
+                   ext="zst", magic=b"\x28\xb5\x2f\xfd")
+
+if find_spec("lz4") is not None:
+    import lz4.frame
+
+    def _open_lz4(path, mode, level=None, threads=None):
+        return lz4.frame.open(path, mode, compression_level=0 if level is None else level)
+
+    register_codec("lz4", _open_lz4, lambda data, level=None, threads=None: lz4.frame.compress(data, compression_level=0 if level is None else level),
+                   lz4.frame.decompress, ext="lz4", magic=b"\x04\x22\x4d\x18")
+
+
+##############################################################################################################################
+"""                                                 IV. Automatic format                                                   """
+##############################################################################################################################
+
+NPY_MAGIC = b"\x93NUMPY"
+
+def auto_codec():
+    """Fast codec for small objects: config.AUTO_CODEC, otherwise the first available of zstd, lz4, gzip."""
+    if config.AUTO_CODEC is not None:
+        return get_codec(config.AUTO_CODEC)
+    for name in ("zstd", "lz4", "gzip"):
+        if name in codecs:
+            return codecs[name]
+
+def auto_format(data, min_bytes=None):
     """
-    try:
-        shell = get_ipython().__class__.__name__
-        if shell == 'ZMQInteractiveShell': # script being run in Jupyter notebook
-            from tqdm.notebook import tqdm
-        elif shell == 'TerminalInteractiveShell': #script being run in iPython terminal
-            from tqdm import tqdm
-    except NameError:
-            from tqdm import tqdm # Probably runing on standard python terminal.
+    Storage format chosen by save_auto for data.
+        - 'npy':       numeric arrays of at least min_bytes. Loaded memory-mapped.
+        - 'parquet':   DataFrames with string column names (requires pyarrow).
+        - 'pkl5':      other objects of at least min_bytes (see memory.getsize). Large buffers are neither copied on saving nor on loading.
+        - 'codec':     small objects. Pickled and compressed with a fast codec (see auto_codec).
+    min_bytes: None => config.AUTO_MIN_BYTES.
+    """
+    from .memory import getsize
+    min_bytes = config.AUTO_MIN_BYTES if min_bytes is None else min_bytes
+    if isinstance(data, np.ndarray) and data.dtype != object and data.nbytes >= min_bytes:
+        return "npy"
+    elif isinstance(data, pd.DataFrame) and _HAVE_PYARROW and all(isinstance(c, str) for c in data.columns):
+        return "parquet"
+    elif getsize(data) >= min_bytes:
+        return "pkl5"
+    else:
+        return "codec"
+
+def save_auto(data, filename, parent_dir=parent_dir, min_bytes=None, level=None):
+    """
+    Stores data in the format best suited to its type and size (see auto_format).
+    The format is identified by the leading bytes of the file, so load_auto dispatches without trying every loader.
+    min_bytes: size threshold for the uncompressed formats. None => config.AUTO_MIN_BYTES.
+    level:     compression level of the fast codec.
+    """
+    fmt = auto_format(data, min_bytes)
+    parent_dir, filename = save_preprocess(filename, "auto", parent_dir)
+    with atomic_path(os.path.join(parent_dir, filename)) as tmp_path:
+        if fmt == "npy":
+            with open(tmp_path, 'wb') as f:
+                np.save(f, data)
+        elif fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            try:
+                table = pa.Table.from_pandas(data)
+            except (pa.ArrowException, TypeError): # columns of mixed types
+                fmt = "codec"
+            else:
+                pq.write_table(table, tmp_path)
+        elif fmt == "pkl5":
+            _write_pkl5(data, tmp_path)
+        if fmt == "codec":
+            codec = auto_codec()
+            with codec.open(tmp_path, 'wb', level=1 if level is None and codec.name == "gzip" else level) as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return
+
+def load_auto(path, mmap_mode="r", columns=None, filters=None, **kwargs):
+    """
+    Loads a file stored by save_auto. The format is detected from the file header.
+    mmap_mode:          arrays ('npy' format, see load_npy) and objects with large buffers ('pkl5' format, see load_pkl5).
+    columns, filters:   DataFrames (see load_parquet).
+    kwargs:             saving options. Ignored.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(8)
+    if header.startswith(NPY_MAGIC):
+        return np.load(path, mmap_mode=mmap_mode)
+    elif header.startswith(PARQUET_MAGIC):
+        return load_parquet(path, columns=columns, filters=filters)
+    elif header.startswith(PKL5_MAGIC):
+        data = load_pkl5(path, mmap_mode=mmap_mode)
+    else:
+        data = load_pkl(path)
+    if isinstance(data, pd.DataFrame) and (columns is not None or filters):
+        data = apply_filters(data, filters)
+        if columns is not None:
+            data = data[columns]
+    return data
+
+
+##############################################################################################################################
+"""                                                   V. Compression                                                       """
+##############################################################################################################################
+
+compress_journal_name = ".tidypath_compress_journal"
 
-    # Get all the paths with the desired extension and minimum size.
-    files = []
+class _HashingWriter():
+    """File wrapper hashing everything written through it."""
+    def __init__(self, f, hasher):
+        self.f = f
+        self.hasher = hasher
 
-    for dirpath, subdirList, fileList in os.walk(rootDir):
-        files += [os.path.join(dirpath, file) for file in fileList if os.path.splitext(file)[1] == extension]
+    def write(self, data):
+        self.hasher.update(data)
+        return self.f.write(data)
 
-    if min_size > 0:
-        files = [file for file in files if os.path.getsize(file) > min_size*1e6]
+def _stream_digest(f, blocksize=2**20):
+    hasher = hashlib.sha256()
+    for buf in iter(lambda: f.read(blocksize), b""):
+        hasher.update(buf)
+    return hasher.hexdigest()
 
-    # Load files, compress, save and delete if compressed_file == pre_compressed_file
+def _compress_file(file, extension, compress_to, level, loading_key):
+    """
+    Compresses file with the codec compress_to. The new file is verified by comparing the checksum of its decompressed stream
+    with the checksum of the stream written. Returns (file, status) with status in 'done', 'bad_compression', 'deleted_files', 'missing'.
+    """
+    codec = get_codec(compress_to)
+    if not os.path.exists(file): # resumed run: processed before the interruption was recorded, or removed
+        return file, 'missing'
     if extension == '.json':
-        loader = load_json
+        try:
+            data = load_json(file, int_keys=True)
+        except ValueError:
+            data = load_json(file, int_keys=False)
     elif extension == '.npz':
-        loader = load_npz
-    else:
-        raise ValueError("extension = '{}' not valid. Available options: '.json', '.npz'".format(extension))
-
-    if compress_to == 'lzma':
-        compressor = save_lzma
-        load_compressor = load_lzma
-    elif compress_to == 'bz2':
-        compressor = save_bz2
-        load_compressor = load_bz2
+        try:
+            data = load_npz(file, key=loading_key)
+        except zipfile.BadZipFile: # corrupted file
+            os.remove(file)
+            return file, 'deleted_files'
+
+    new_filename = '{}.{}'.format(os.path.splitext(file)[0], codec.ext)
+    hasher = hashlib.sha256()
+    with atomic_path(new_filename) as tmp_path:
+        with codec.open(tmp_path, 'wb', level=level) as f:
+            writer = _HashingWriter(f, hasher)
+            if extension in ('.json', '.npz'):
+                pickle.dump(data, writer)
+            else: # compressed pickle => recompress the pickle stream, without unpickling it
+                with open(file, 'rb') as source:
+                    source_codec = detect_codec(source.read(8))
+                with source_codec.open(file, 'rb') as source:
+                    for buf in iter(lambda: source.read(2**20), b""):
+                        writer.write(buf)
+    with codec.open(new_filename, 'rb') as f:
+        verified = _stream_digest(f) == hasher.hexdigest()
+    if verified:
+        os.remove(file)
+        return file, 'done'
     else:
-        raise ValueError("compress_to = '{}' not valid. Available options: 'lzma', 'bz2'".format(extension))
+        return file, 'bad_compression'
 
-    not_correctly_processed = {'bad_compression': []}
-    pbar = tqdm(range(len(files)))
+def compress_files(rootDir=parent_dir, extension='.json', compress_to='lzma', min_size=0, loading_key=None, n_jobs=1, level=None, resume=True):
+    """
+    Searches in a directory and all its subdirectories files with a certain extension and compresses them.
 
-    if extension == '.json':
-        for file in files:
-            try:
-                pre_compressed = loader(file, int_keys=True)
-            except ValueError:
-                pre_compressed = loader(file, int_keys=False)
+    Attributes:
+    - rootDir: The root directory.
+    - extension: Extension setting which files should be compressed. Available options: '.json', '.npz' and the extensions of the registered codecs
+                 (compressed pickles, e.g. '.pbz2', '.lzma', '.gz'). The latter are recompressed without unpickling them.
+    - compress_to: Codec after compression. Available options: registered codecs (storage.codecs), e.g. 'lzma', 'bz2', 'gzip', 'zstd'.
+                   The new file has the codec extension.
+    - min_size: Minimum size for applying compression (in MB).
+    - loading_key: Key for retrieving the data in a npz file. If None, retrieves the data corresponding to the first key.
+    - n_jobs: Number of processes. None => os.cpu_count().
+    - level: Compression level (codec specific). None => codec default.
+    - resume: Continue a previous interrupted run. The list of files to compress and the processed files are recorded in a journal in rootDir
+              ('.tidypath_compress_journal', deleted when the run reaches the end). On resume, the directory is not walked again:
+              the remaining files of the recorded list are compressed (files that failed the verification are retried).
+              Failed files are reported in the returned dict. Runs after a completed one walk the directory again.
 
-            new_filename = '{}.{}'.format(os.path.splitext(file)[0], compress_to)
-            compressor(pre_compressed, new_filename, parent_dir="")
-            compressed_file = load_compressor(new_filename)
+    Each compressed file is verified by comparing the checksums of the stream written and the decompressed stream, then the original is deleted.
 
-            if compressed_file == pre_compressed:
-                os.remove(file)
+    Returns: Dict containing the name of the files that could not be processed ('bad compression') or those that were corrupted and had to be deleted('deleted files').
+    """
+    if find_spec("tqdm") is None:
+        tqdm = None
+    else:
+        try:
+            shell = get_ipython().__class__.__name__
+            if shell == 'ZMQInteractiveShell': # script being run in Jupyter notebook
+                from tqdm.notebook import tqdm
             else:
-                not_correctly_processed['bad_compression'].append(file)
+                from tqdm import tqdm
+        except NameError:
+            from tqdm import tqdm # Probably runing on standard python terminal.
+
+    source_exts = {f".{codec.ext}" for codec in codecs.values() if codec.ext is not None}
+    if extension not in ('.json', '.npz', *source_exts):
+        raise ValueError("extension = '{}' not valid. Available options: {}".format(extension, ['.json', '.npz', *sorted(source_exts)]))
+    if f".{get_codec(compress_to).ext}" == extension:
+        raise ValueError(f"Files with extension '{extension}' are already compressed with '{compress_to}'.")
+
+    journal_path = os.path.join(rootDir, compress_journal_name)
+    task = f"{extension}->{compress_to}:{min_size}"
+    planned, processed = [], set()
+    plan_complete = False
+    if resume and os.path.exists(journal_path):
+        with open(journal_path, 'r') as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t", 2)
+                if len(fields) != 3 or fields[0] != task: # other task or truncated line
+                    continue
+                elif fields[1] == "todo":
+                    planned.append(fields[2])
+                elif fields[1] == "planned":
+                    plan_complete = len(planned) == int(fields[2])
+                elif fields[1] != "bad_compression":
+                    processed.add(fields[2])
+        if not plan_complete:
+            planned, processed = [], set()
+
+    if planned: # resume: skip the walk
+        files = [file for file in planned if file not in processed]
+    else:
+        # Get all the paths with the desired extension and minimum size.
+        files = []
+        for dirpath, subdirList, fileList in os.walk(rootDir):
+            files += [os.path.join(dirpath, file) for file in fileList if os.path.splitext(file)[1] == extension]
 
-            pbar.refresh()
-            print(pbar.update())
+        if min_size > 0:
+            files = [file for file in files if os.path.getsize(file) > min_size*1e6]
 
+        with open(journal_path, 'w') as journal:
+            journal.writelines(f"{task}\ttodo\t{file}\n" for file in files)
+            journal.write(f"{task}\tplanned\t{len(files)}\n")
+
+    not_correctly_processed = {'bad_compression': []}
     if extension == '.npz':
         not_correctly_processed['deleted_files'] = []
-        for file in files:
-            try:
-                pre_compressed = loader(file, key=loading_key)
-            except zipfile.BadZipFile: # corrupted file
-                os.remove(file)
-                not_correctly_processed['deleted_files'].append(file)
-                continue
-
-            new_filename = '{}.{}'.format(os.path.splitext(file)[0], compress_to)
-            compressor(pre_compressed, new_filename, parent_dir="")
-            compressed_file = load_compressor(new_filename)
-
-            if np.all(compressed_file == pre_compressed):
-                os.remove(file)
-            else:
-                not_correctly_processed['bad_compression'].append(file)
-            pbar.refresh()
-            print(pbar.update())
-
+    pbar = None if tqdm is None else tqdm(total=len(files))
+
+    with open(journal_path, 'a') as journal:
+        def process_result(file, status):
+            if status not in ('done', 'missing'):
+                not_correctly_processed[status].append(file)
+            journal.write(f"{task}\t{status}\t{file}\n")
+            journal.flush()
+            if pbar is not None:
+                pbar.update()
+
+        if n_jobs == 1:
+            for file in files:
+                process_result(*_compress_file(file, extension, compress_to, level, loading_key))
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                futures = [executor.submit(_compress_file, file, extension, compress_to, level, loading_key) for file in files]
+                for future in as_completed(futures):
+                    process_result(*future.result())
+    if pbar is not None:
+        pbar.close()
+
+    os.remove(journal_path) # run completed: the next run walks the directory again (new files, retry of failed ones)
     return not_correctly_processed
 
 
 ##############################################################################################################################
-"""                                                   IV. Deletion                                                         """
+"""                                                   VI. Deletion                                                         """
 ##############################################################################################################################
 def _delete_files_newer_than(
     directory: str,
@@ -241,8 +806,10 @@ def _delete_files_newer_than(
     recursive: bool = False,
     file_extensions: Optional[List[str]] = None,
     exclude_patterns: Optional[List[str]] = None,
-    verbose: bool = True
-) -> Tuple[List[str], List[str]]:
+    verbose: bool = True,
+    n_jobs: int = 1,
+    quiet: bool = False
+) -> Union[Tuple[List[str], List[str]], pd.DataFrame]:
     """
     Delete files in a directory that are newer than time [time_unit].
 
@@ -257,9 +824,12 @@ def _delete_files_newer_than(
         exclude_patterns (List[str], optional): Skip files containing these patterns
             Example: ['backup', 'important', 'keep']
         verbose (bool): If True, print detailed information
+        n_jobs (int): Threads scanning subdirectories in parallel (see tidypath.scan.scan)
+        quiet (bool): If True, do not print anything and return a DataFrame
 
     Returns:
         Tuple[List[str], List[str]]: (successfully_processed, failed_files)
+        quiet => pd.DataFrame: files newer than the threshold. Columns: path, name, size, mtime, modified, deleted, error
 
     Raises:
         ValueError: If directory doesn't exist or is not a directory
@@ -277,7 +847,10 @@ def _delete_files_newer_than(
     if not dir_path.is_dir():
         raise ValueError(f"Path is not a directory: {directory}")
 
-    # Calculate cutoff time (7 days ago)
+    if quiet:
+        verbose = False
+
+    # Calculate cutoff time
     time_unit_mpl = dict(s=1, m=60, h=3600, d=3600*24, w=3600*24*7)
     dt = t * time_unit_mpl[time_unit]
     past_time = time.time() - dt
@@ -298,79 +871,68 @@ def _delete_files_newer_than(
     successfully_processed = []
     failed_files = []
 
-    def should_process_file(file_path: Path) -> bool:
-        """Check if file should be processed based on filters"""
+    def onerror(e):
+        if os.path.abspath(e.filename) == os.path.abspath(directory):
+            raise e
+        error_msg = f"Error processing {e.filename}: {str(e)}"
+        if verbose:
+            print(f"  ERROR: {error_msg}")
+        failed_files.append(error_msg)
 
-        # Check file extension filter
-        if file_extensions:
-            if file_path.suffix.lower() not in [ext.lower() for ext in file_extensions]:
-                return False
+    try:
+        files = scan_frame(directory, recursive=recursive, n_jobs=n_jobs, onerror=onerror)
+        total_files = len(files)
 
-        # Check exclude patterns
+        # Filters
+        names = files["name"].str.lower()
+        keep = np.ones(total_files, dtype=bool)
+        if file_extensions:
+            extensions = {ext.lower() for ext in file_extensions}
+            keep &= np.array([os.path.splitext(name)[1] in extensions for name in names], dtype=bool)
         if exclude_patterns:
-            file_name = file_path.name.lower()
+            excluded = np.zeros(total_files, dtype=bool)
             for pattern in exclude_patterns:
-                if pattern.lower() in file_name:
-                    if verbose:
-                        print(f"  SKIPPED (excluded pattern): {file_path}")
-                    return False
-
-        return True
-
-    def process_file(file_path: Path) -> bool:
-        """Process a single file - check age and delete if newer than threshold"""
-        try:
-            # Get file modification time
-            file_mtime = file_path.stat().st_mtime
-            file_datetime = datetime.datetime.fromtimestamp(file_mtime)
-
-            # Check if file is newer than theshold
-            if file_mtime > past_time:
+                excluded |= names.str.contains(pattern.lower(), regex=False).values
+            if verbose:
+                for file_path in files["path"].values[keep & excluded]:
+                    print(f"  SKIPPED (excluded pattern): {file_path}")
+            keep &= ~excluded
+        files = files[keep]
+
+        # Check if files are newer than threshold
+        newer = files["mtime"].values > past_time
+        deleted = np.zeros(len(files), dtype=bool)
+        errors = np.full(len(files), None, dtype=object)
+        for i in (range(len(files)) if verbose else np.flatnonzero(newer)):
+            file_path = files["path"].iat[i]
+            file_datetime = datetime.datetime.fromtimestamp(files["mtime"].iat[i])
+            if newer[i]:
                 if verbose:
                     print(f"  NEWER THAN {time_threshold}: {file_path}")
                     print(f"    Modified: {file_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
 
                 if not dry_run:
-                    file_path.unlink()  # Delete the file
+                    try:
+                        os.unlink(file_path)  # Delete the file
+                    except OSError as e:
+                        error_msg = f"Error processing {file_path}: {str(e)}"
+                        if verbose:
+                            print(f"  ERROR: {error_msg}")
+                        failed_files.append(error_msg)
+                        errors[i] = error_msg
+                        continue
+                    deleted[i] = True
                     if verbose:
                         print(f"    DELETED: {file_path}")
                 else:
                     if verbose:
                         print(f"    WOULD DELETE: {file_path}")
 
-                successfully_processed.append(str(file_path))
-                return True
+                successfully_processed.append(file_path)
             else:
-                if verbose:
-                    print(f"  OLDER THAN {time_threshold} (keeping): {file_path}")
-                    print(f"    Modified: {file_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
-                return False
-
-        except (OSError, IOError) as e:
-            error_msg = f"Error processing {file_path}: {str(e)}"
-            if verbose:
-                print(f"  ERROR: {error_msg}")
-            failed_files.append(error_msg)
-            return False
-
-    try:
-        # Get files to process
-        if recursive:
-            file_iterator = dir_path.rglob('*')
-        else:
-            file_iterator = dir_path.iterdir()
-
-        # Process files
-        total_files = 0
-        processed_files = 0
-
-        for item in file_iterator:
-            if item.is_file():
-                total_files += 1
-
-                if should_process_file(item):
-                    if process_file(item):
-                        processed_files += 1
+                print(f"  OLDER THAN {time_threshold} (keeping): {file_path}")
+                print(f"    Modified: {file_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
+        processed_files = len(successfully_processed)
 
         # Summary
         if verbose:
@@ -392,10 +954,15 @@ def _delete_files_newer_than(
     except Exception as e:
         raise RuntimeError(f"Unexpected error processing directory: {str(e)}") from e
 
-    return successfully_processed, failed_files
+    if quiet:
+        return files[newer].assign(modified=pd.to_datetime(files["mtime"].values[newer], unit='s'),
+                                   deleted=deleted[newer],
+                                   error=errors[newer]).drop(columns="is_dir").reset_index(drop=True)
+    else:
+        return successfully_processed, failed_files
 
 
-def delete_files_newer_than(directory: str, dry_run: bool = True, t: float = 1.0, time_unit='d') -> None:
+def delete_files_newer_than(directory: str, dry_run: bool = True, t: float = 1.0, time_unit='d', quiet: bool = False) -> Optional[pd.DataFrame]:
     """
     Simplified version - just delete files newer than t [time_unit]
 
@@ -404,7 +971,10 @@ def delete_files_newer_than(directory: str, dry_run: bool = True, t: float = 1.0
         dry_run (bool): If True, only simulate deletion (safer default)
         t: float: Time threshold in units of time_unit
         time_unit (str): Unit of time, e.g. 'd' for days
+        quiet (bool): If True, do not print anything and return a DataFrame with the files newer than t (see _delete_files_newer_than)
     """
+    if quiet:
+        return _delete_files_newer_than(directory=directory, dry_run=dry_run, t=t, time_unit=time_unit, quiet=True)
     try:
         processed, failed = _delete_files_newer_than(
             directory=directory,
@@ -415,11 +985,11 @@ def delete_files_newer_than(directory: str, dry_run: bool = True, t: float = 1.0
         )
 
         if not dry_run and processed:
-            print(f"\nSUCCESS: Deleted {len(processed)} files newer than {time} [{time_unit}]")
+            print(f"\nSUCCESS: Deleted {len(processed)} files newer than {t} [{time_unit}]")
         elif dry_run and processed:
-            print(f"\nDRY RUN: Would delete {len(processed)} files newer than {time} [{time_unit}]")
+            print(f"\nDRY RUN: Would delete {len(processed)} files newer than {t} [{time_unit}]")
         else:
-            print(f"\nNo files newer than {time} [{time_unit}] found in {directory}")
+            print(f"\nNo files newer than {t} [{time_unit}] found in {directory}")
 
     except Exception as e:
         print(f"ERROR: {str(e)}")